@@ -1,4 +1,10 @@
-from .calculator import transactions, cagr, pnl, cashflow, xirr
+from .calculator import transactions, cagr, pnl, cashflow, stock_cashflows, xirr, xirr_batch, cashflow_matrix, xirr_series
+from .columnar import Records, Lots, Cashflow, StockCashflows
+from .lotbook import LotBook
+from .lotindex import LotIndex
+from .pricestore import PriceStore
+from .resultcache import ResultCache
+from .scenario import Scenarios
 
 __version__ = '0.0.1'
 
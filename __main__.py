@@ -1,70 +1,194 @@
+import argparse
+import csv
 import datetime
-from calculator import transactions, cagr, pnl, cashflow, xirr
-from fileio import list_csv_files
-from trendanalyzer import get_portfolio_summary,parse_portfolio_file, map_portfolio_summary
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from .calculator import transactions, cagr, pnl, cashflow, xirr
+from .fileio import read_records_columnar, parse_prices_file, write_lots, write_pnl, write_cashflow, iter_csv_files
+from .parallel import transactions_pnl
+from .trendanalyzer import map_portfolio_summary
 
-if __name__ == "__main__":
-
-    """
-    records = [{'date': datetime.date(2020, 4, 27), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 21.0, 'price': 4568.7286},
-    {'date': datetime.date(2020, 5, 15), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 3.0, 'price': 4720.35},
-    {'date': datetime.date(2020, 6, 15), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 2.0, 'price': 5195.0},
-    {'date': datetime.date(2020, 7, 15), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 2.0, 'price': 6415.325},
-    {'date': datetime.date(2020, 8, 24), 'action': 'Sell', 'stock': 'Bajaj Finserv Limited', 'quantity': 10.0, 'price': 6420.049},
-    {'date': datetime.date(2020, 9, 1), 'action': 'Sell', 'stock': 'Bajaj Finserv Limited', 'quantity': 5.0, 'price': 6640.8},
-    {'date': datetime.date(2020, 9, 24), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 10.0, 'price': 5420.05},
-    {'date': datetime.date(2020, 12, 2), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 2.0, 'price': 8739.25},
-    {'date': datetime.date(2020, 12, 16), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 1.0, 'price': 9325.0},
-    {'date': datetime.date(2020, 12, 21), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 5.0, 'price': 8870.75},
-    {'date': datetime.date(2021, 1, 18), 'action': 'Buy', 'stock': 'Bajaj Finserv Limited', 'quantity': 1.0, 'price': 8362.55},
-    {'date': datetime.date(2020, 2, 20), 'action': 'Buy', 'stock': 'Avenue Supermarkets Limited', 'quantity': 3.0, 'price': 2472.0000},
-    {'date': datetime.date(2020, 3, 16), 'action': 'Buy', 'stock': 'Avenue Supermarkets Limited', 'quantity': 4.0, 'price': 2012.0000},
-    {'date': datetime.date(2020, 5, 14), 'action': 'Sell', 'stock': 'Avenue Supermarkets Limited', 'quantity': 4.0, 'price': 2345.9000}]
-
-    prices = {'Bajaj Finserv Limited': 10200.50, 'Avenue Supermarkets Limited': 3151.95}
-
-    trans = transactions(records, prices)
+records_filename = 'records.csv'
+prices_filename = 'prices.csv'
 
-    print("--------------- Matched transactions ---------------")
-    for tran in trans:
-        print(tran)
 
+def _date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
 
-    trans = cagr(trans)
-
-    print("--------------- Transaction wise CAGR ---------------")
-    for tran in trans:
-    	print(tran)
 
+def _account_files(account):
+    """
+    This function returns the name, records file and prices file of an account, which
+    is either a folder with records.csv and prices.csv or a records file with a
+    prices file next to it.
+    """
+    if os.path.isdir(account):
+        return os.path.basename(os.path.normpath(account)), os.path.join(account, records_filename), os.path.join(account, prices_filename)
+    folder = os.path.dirname(account)
+    name = os.path.splitext(os.path.basename(account))[0]
+    return name, account, os.path.join(folder, prices_filename)
 
-    print("--------------- Total P&L ---------------")
-    pnl= pnl(trans)
-    print(pnl)
 
-   
-    cashflow = cashflow(records, prices)
-    print("--------------- Cashflow ---------------")
-    for tran in cashflow:
-    	print(tran, cashflow[tran])
-    print(cashflow)
+def _modified_since(account, since):
+    records_file = _account_files(account)[1]
+    try:
+        modified = datetime.date.fromtimestamp(os.stat(records_file).st_mtime)
+    except OSError:
+        # The account is processed to report the missing records file.
+        return True
+    return modified >= since
 
 
-    xirr = xirr(cashflow)
-    print("--------------- XIRR ---------------")
-    print("XIRR = ", xirr)
+def _process_account(command, account, output, policy, shards=1):
+    """
+    This function reads, calculates and writes the output of a single account. It is
+    run in the worker processes and returns a summary dict of the account. An error
+    of the account is returned in the error of the summary, so that the rest of the
+    accounts are still processed.
     """
+    try:
+        return _account_summary(command, account, output, policy, shards)
+    except Exception as error:
+        return {'account': _account_files(account)[0], 'error': '%s: %s' % (type(error).__name__, error)}
+
+
+def _account_summary(command, account, output, policy, shards):
+    name, records_file, prices_file = _account_files(account)
+    records = read_records_columnar(records_file)
+    prices = parse_prices_file(prices_file)
+
+    summary = {'account': name, 'records': len(records)}
+    folder = None
+    if output is not None:
+        folder = os.path.join(output, name)
+        os.makedirs(folder, exist_ok=True)
+
+    if command in ('transactions', 'pnl'):
+        if shards > 1:
+            trans, account_pnl = transactions_pnl(records, prices, policy, shards)
+        else:
+            trans = cagr(transactions(records, prices, policy))
+            account_pnl = pnl(trans)
+        total = account_pnl.get('TOTAL', {})
+        summary['realized'] = total.get('realized', 0.0)
+        summary['unrealized'] = total.get('unrealized', 0.0)
+        if folder is not None:
+            if command == 'transactions':
+                write_lots(trans, os.path.join(folder, 'transactions.csv'))
+            elif len(account_pnl) > 0:
+                write_pnl(account_pnl, os.path.join(folder, 'pnl.csv'))
+
+    elif command == 'xirr':
+        flows = cashflow(records, prices)
+        try:
+            summary['xirr'] = float(xirr(flows))
+        except RuntimeError:
+            summary['xirr'] = None
+        if folder is not None:
+            write_cashflow(flows, os.path.join(folder, 'cashflow.csv'))
+
+    return summary
+
+
+def _pipeline(func, items, workers):
+    """
+    This function streams the results of func over the items in order. With more than
+    one worker the items are processed in a process pool with at most two items per
+    worker in flight, so that results are written while the rest is computed.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(*item)
+        return
 
-    filepath = '/Users/vivekkant/Dropbox/Account/Portfolio/VK/portfolio-out'
-    summaryfile = '/Users/vivekkant/temp/portfolio'
-    
-    filelist = list_csv_files(filepath)
-    for csvfile in filelist:
-        print(get_portfolio_summary(csvfile))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, *item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
 
-    print('Creating a summary file...')
-    map_portfolio_summary(filelist, summaryfile)
-        
 
+def _accounts(args):
+    for account in args.accounts:
+        if args.since is not None and not _modified_since(account, args.since):
+            continue
+        yield (args.command, account, args.output, args.policy, args.shards)
 
 
+def run_accounts(args):
+    """
+    This function prints the summary line of each account. The accounts which failed
+    are also reported on stderr, and the exit status is 1 when any account failed.
+    """
+    columns = {'transactions': ['account', 'records', 'realized', 'unrealized', 'error'],
+        'pnl': ['account', 'records', 'realized', 'unrealized', 'error'],
+        'xirr': ['account', 'records', 'xirr', 'error']}[args.command]
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(columns)
+    failed = 0
+    for summary in _pipeline(_process_account, _accounts(args), args.workers):
+        writer.writerow(['' if summary.get(column) is None else summary.get(column) for column in columns])
+        sys.stdout.flush()
+        if summary.get('error') is not None:
+            failed += 1
+            print('%s: %s' % (summary['account'], summary['error']), file=sys.stderr)
+    return 1 if failed > 0 else 0
+
+
+def run_trend(args):
+    """
+    This function writes the summary files of all the snapshots. The summary files
+    are rewritten with the whole series, so --since and --until only limit the
+    snapshots which are checked for changes, and the others are taken from the cache.
+    """
+    filelist = list(iter_csv_files(args.snapshots, sort=True))
+    update = None
+    if args.since is not None or args.until is not None:
+        update = list(iter_csv_files(args.snapshots, since=args.since, until=args.until, sort=True))
+    os.makedirs(args.output, exist_ok=True)
+    map_portfolio_summary(filelist, args.output, workers=args.workers, fast=args.fast, cache_file=args.cache,
+        io_limit=args.io_limit, update=update)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='returnscalculator', description='Calculate CAGR, P&L and XIRR of portfolios')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, description in (('transactions', 'match records into transactions with CAGR'),
+            ('pnl', 'realized and unrealized P&L by stock'),
+            ('xirr', 'cashflow and XIRR')):
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument('accounts', nargs='+',
+            help='account folders with %s and %s, or records files with %s next to them' % (records_filename, prices_filename, prices_filename))
+        subparser.add_argument('-o', '--output', help='folder for the output files, one folder per account')
+        subparser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+        if command != 'xirr':
+            subparser.add_argument('--policy', default='fifo', choices=['fifo', 'lifo', 'average'])
+            subparser.add_argument('--shards', type=int, default=1, help='number of processes the stocks of each account are matched in')
+        subparser.add_argument('--since', type=_date, help='only the accounts whose records changed on or after this date (YYYY-MM-DD)')
+        subparser.set_defaults(run=run_accounts, policy='fifo', shards=1)
+
+    subparser = subparsers.add_parser('trend', help='portfolio summary trend of daily snapshot folders')
+    subparser.add_argument('snapshots', help='folder of YYYY-MM-DD snapshot folders')
+    subparser.add_argument('output', help='folder for the summary files')
+    subparser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    subparser.add_argument('--since', type=_date, help='only check the snapshots from this date (YYYY-MM-DD) for changes, needs --cache')
+    subparser.add_argument('--until', type=_date, help='only check the snapshots up to this date (YYYY-MM-DD) for changes, needs --cache')
+    subparser.add_argument('--cache', help='summary cache file, only new or changed snapshots are parsed')
+    subparser.add_argument('--fast', action='store_true', help='read the totals row from the end of the snapshots')
+    subparser.add_argument('--io-limit', type=int, help='read the snapshots asynchronously, at most this many at a time')
+    subparser.set_defaults(run=run_trend)
+
+    args = parser.parse_args(argv)
+    if args.command == 'trend' and args.cache is None and (args.since is not None or args.until is not None):
+        parser.error('--since and --until need --cache, the summaries of the other snapshots are taken from it')
+    return args.run(args)
+
 
+if __name__ == "__main__":
+    sys.exit(main())
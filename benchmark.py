@@ -0,0 +1,222 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from .calculator import transactions, cagr, pnl, cashflow, xirr
+from .columnar import Records
+from .fileio import parse_records_file, read_records_columnar, map_cagr_transactions_file, write_lots, list_csv_files
+from .moneyspire import map_record
+from .trendanalyzer import parse_portfolio_file, map_portfolio_summary
+
+
+def generate_records(symbols=50, trades=1000, years=5, partial_fills=0.3, seed=0, start=datetime.date(2015, 1, 1)):
+    """
+    This function generates a seeded synthetic trade history.
+    The inout are as follows:
+        symbols - The number of stocks
+        trades - The number of orders per stock
+        years - The number of years the orders are spread over
+        partial_fills - The share of orders which are filled in several records
+        seed - The seed of the random generator
+        start - The date of the first trading day
+    The prices of each stock follow a random walk, about a third of the orders are
+    sells of part of the held quantity, and a partially filled order is split into
+    several records on the same date. It returns a list of record dicts sorted by date.
+    """
+    rng = np.random.default_rng(seed)
+    days = int(years * 365)
+    records = []
+
+    for symbol in range(symbols):
+        stock = 'STOCK%04d' % symbol
+        offsets = np.sort(rng.integers(0, days, size=trades))
+        walk = np.exp(np.cumsum(rng.normal(0.0003, 0.02, size=days)))
+        prices = rng.uniform(10, 5000) * walk
+        is_sell = rng.random(trades) < 0.35
+        fills = np.where(rng.random(trades) < partial_fills, rng.integers(2, 6, size=trades), 1)
+        held = 0.0
+
+        for offset, sell, fill_count in zip(offsets.tolist(), is_sell.tolist(), fills.tolist()):
+            price = round(float(prices[offset]), 2)
+            if sell and held > 0:
+                action = 'Sell'
+                quantity = float(rng.integers(1, int(held) + 1))
+                held -= quantity
+            else:
+                action = 'Buy'
+                quantity = float(rng.integers(1, 200))
+                held += quantity
+
+            fill_sizes = np.diff(np.sort(np.concatenate((
+                [0.0, quantity], rng.integers(1, max(2, int(quantity)), size=fill_count - 1)))))
+            for fill in fill_sizes.tolist():
+                if fill <= 0:
+                    continue
+                record = {}
+                record['date'] = start + datetime.timedelta(days=offset)
+                record['action'] = action
+                record['stock'] = stock
+                record['quantity'] = fill
+                record['price'] = price
+                records.append(record)
+
+    records.sort(key=lambda record: record['date'])
+    return records
+
+
+def generate_prices(records, seed=0):
+    """
+    This function generates the current prices of the stocks of the records as the
+    last traded price moved by a random return.
+    """
+    rng = np.random.default_rng(seed)
+    last_prices = {}
+    for record in records:
+        last_prices[record['stock']] = record['price']
+    return {stock: round(price * float(np.exp(rng.normal(0, 0.1))), 2) for stock, price in last_prices.items()}
+
+
+def generate_snapshots(filepath, days=30, files=5, rows=200, seed=0, start=datetime.date(2020, 1, 1)):
+    """
+    This function writes synthetic daily portfolio snapshot folders of CSV files
+    with a totals row, in the layout read by trendanalyzer.
+    """
+    rng = np.random.default_rng(seed)
+    for day in range(days):
+        folder = os.path.join(filepath, (start + datetime.timedelta(days=day)).isoformat())
+        os.makedirs(folder, exist_ok=True)
+        for index in range(files):
+            costs = rng.uniform(100, 10000, size=rows)
+            values = costs * rng.uniform(0.5, 2.0, size=rows)
+            with open(os.path.join(folder, 'portfolio%d.csv' % index), 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['Symbol', 'Name', 'Cost basis', 'Total'])
+                for row in range(rows):
+                    writer.writerow(['SYM%d' % row, 'Name %d' % row, round(costs[row], 2), round(values[row], 2)])
+                writer.writerow(['', 'Total', round(costs.sum(), 2), round(values.sum(), 2)])
+
+
+def measure(name, count, func, repeat=3):
+    """
+    This function times a function and returns a dict of the best wall time of the
+    repeats, the throughput in items per second and the peak traced memory of a
+    separate run under tracemalloc.
+    """
+    seconds = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - begin)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    best = min(seconds)
+    result = {}
+    result['name'] = name
+    result['items'] = count
+    result['seconds'] = best
+    result['throughput'] = count / best if best > 0 else None
+    result['peak_bytes'] = peak
+    return result
+
+
+def run(symbols=50, trades=1000, years=5, partial_fills=0.3, seed=0, repeat=3, snapshot_days=30, snapshot_files=5):
+    """
+    This function runs the benchmarks of the calculator, fileio and trendanalyzer
+    hot paths on synthetic data and returns a dict of the parameters and results.
+    """
+    records = generate_records(symbols, trades, years, partial_fills, seed)
+    prices = generate_prices(records, seed)
+    columnar = Records.from_dicts(records)
+    count = len(records)
+
+    results = []
+    trans = cagr(transactions(records, prices))
+    lots = cagr(transactions(columnar, prices))
+    flows = cashflow(columnar, prices)
+
+    results.append(measure('records_to_columnar', count, lambda: Records.from_dicts(records), repeat))
+    results.append(measure('transactions', count, lambda: transactions(records, prices), repeat))
+    results.append(measure('transactions_columnar', count, lambda: transactions(columnar, prices), repeat))
+    results.append(measure('cagr', len(trans), lambda: cagr(trans), repeat))
+    results.append(measure('cagr_columnar', len(lots), lambda: cagr(lots), repeat))
+    results.append(measure('pnl', len(trans), lambda: pnl(trans), repeat))
+    results.append(measure('pnl_columnar', len(lots), lambda: pnl(lots), repeat))
+    results.append(measure('cashflow', count, lambda: cashflow(records, prices), repeat))
+    results.append(measure('cashflow_columnar', count, lambda: cashflow(columnar, prices), repeat))
+    results.append(measure('xirr', len(flows), lambda: xirr(flows), repeat))
+
+    with tempfile.TemporaryDirectory() as folder:
+        records_file = os.path.join(folder, 'records.csv')
+        map_record(records, records_file)
+        results.append(measure('parse_records_file', count, lambda: parse_records_file(records_file), repeat))
+        results.append(measure('read_records_columnar', count, lambda: read_records_columnar(records_file), repeat))
+
+        cagr_file = os.path.join(folder, 'transactions.csv')
+        results.append(measure('map_cagr_transactions_file', len(trans),
+            lambda: map_cagr_transactions_file(trans, cagr_file), repeat))
+        results.append(measure('write_lots', len(lots), lambda: write_lots(lots, cagr_file), repeat))
+        results.append(measure('write_lots_npy', len(lots),
+            lambda: write_lots(lots, os.path.join(folder, 'lots'), format='npy'), repeat))
+
+        snapshots = os.path.join(folder, 'snapshots')
+        summaries = os.path.join(folder, 'summaries')
+        os.makedirs(summaries)
+        generate_snapshots(snapshots, snapshot_days, snapshot_files, seed=seed)
+        filelist = list_csv_files(snapshots)
+        results.append(measure('parse_portfolio_file', len(filelist),
+            lambda: [parse_portfolio_file(csvfile) for csvfile in filelist], repeat))
+        results.append(measure('parse_portfolio_file_fast', len(filelist),
+            lambda: [parse_portfolio_file(csvfile, fast=True) for csvfile in filelist], repeat))
+        results.append(measure('map_portfolio_summary', len(filelist),
+            lambda: map_portfolio_summary(filelist, summaries), repeat))
+
+    report = {}
+    report['python'] = platform.python_version()
+    report['numpy'] = np.__version__
+    report['platform'] = platform.platform()
+    report['params'] = {'symbols': symbols, 'trades': trades, 'years': years,
+        'partial_fills': partial_fills, 'seed': seed, 'repeat': repeat, 'records': count,
+        'snapshot_days': snapshot_days, 'snapshot_files': snapshot_files}
+    report['results'] = results
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the returns calculator on synthetic portfolios')
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--trades', type=int, default=1000, help='orders per symbol')
+    parser.add_argument('--years', type=float, default=5)
+    parser.add_argument('--partial-fills', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--snapshot-days', type=int, default=30)
+    parser.add_argument('--snapshot-files', type=int, default=5)
+    parser.add_argument('--output', help='JSON file for the results, printed when not given')
+    args = parser.parse_args(argv)
+
+    report = run(args.symbols, args.trades, args.years, args.partial_fills, args.seed,
+        args.repeat, args.snapshot_days, args.snapshot_files)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as jsonfile:
+            json.dump(report, jsonfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
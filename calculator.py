@@ -1,87 +1,47 @@
 from datetime import date
-from scipy.optimize import newton
-from copy import deepcopy
+import warnings
+from scipy.optimize import root_scalar, brentq
 import numpy as np
+from . import instrument
+from .lotmatch import LotMatcher, get_policy
+from .columnar import Records, Lots, Cashflow, StockCashflows, BUY, SELL, lot_columns, cagr_columns, intern_stocks
 
-def _transactions(records, price):
+def _transactions(records, price, today, policy):
     """
-        This function takes in the transaction records and returns the list of transactions
-        based on the exeution of trades. It uses FIFO method to match buy and sell transactions
-        This is used in calculation of realized & unrealized gains and CAGR at transaction level
-        It is used by the transactions function for matching transactions of a single record.
+        This function takes in the columnar records of a single stock sorted by date and
+        returns the list of transactions based on the exeution of trades. The trades are
+        matched in a single pass with the lot matching policy.
+        It is used by the transactions function for matching transactions of a single stock.
     """
 
-    records = sorted(records, key = lambda i: i['date'], reverse=True)
-
-    buy = []
-    sell = []
+    matcher = LotMatcher(policy)
     trans = []
-    for record in records:
-        action = record["action"]
-        if action == 'Buy':
-            buy.append(record)
-        elif action == 'Sell':
-            sell.append(record)
-
-    while len(buy) > 0:
-        
-        buy_tran = buy.pop()
-        
-        tran = {}
-        tran['stock'] = buy_tran['stock']
-        tran['buy_date'] = buy_tran['date']
-        tran['buy_price'] = buy_tran['price']
-
-        if len(sell) > 0:   
-            sell_tran = sell.pop()
-
-            buy_quant = buy_tran['quantity']
-            sell_quant = sell_tran['quantity']
-
-            tran['sell_date'] = sell_tran['date']
-            tran['sell_price'] = sell_tran['price']
-            tran['realized'] = True
-            
-            if buy_quant > sell_quant:
-                
-                tran['quantity'] = sell_quant
-
-                buy_tran['quantity'] = buy_quant - sell_quant
-                buy.append(buy_tran)
-
-            elif sell_quant > buy_quant:
-
-                tran['quantity'] = buy_quant    
-                
-                sell_tran['quantity'] =  sell_quant - buy_quant 
-                sell.append(buy_tran)
-            
-            else:
 
-                tran['quantity'] = buy_quant
-            
-        else:
-            tran['sell_date'] = date.today()
-            tran['sell_price'] = price
-            tran['quantity'] = buy_tran['quantity']
-            tran['realized'] = False
+    for day, action, stock, quantity, trade_price in records.tolist():
+        if action == BUY:
+            matcher.buy(day, quantity, trade_price)
+        elif action == SELL:
+            for buy_date, buy_price, lot_quantity in matcher.sell(quantity):
+                trans.append((stock, buy_date, buy_price, day, trade_price, True, lot_quantity))
 
-
-        trans.append(tran)
+    for buy_date, buy_price, lot_quantity in matcher.open_lots():
+        trans.append((stock, buy_date, buy_price, today, price, False, lot_quantity))
 
     return trans
 
 
-def transactions(records, prices):
+def transactions(records, prices, policy='fifo'):
     """
 
     This function takes in the transaction records and returns the list of transactions
     based on the exeution of trades. It uses FIFO method to match buy and sell transactions
+    unless another lot matching policy is given.
     This is used in calculation of realized & unrealized gains and CAGR at transaction level
 
     INPUT
     -----
-    record : A list of dictionary with the following keys
+    record : A list of dictionary with the following keys, or the same records
+    as columnar.Records
         date - Date in datetime.date format
         action - String either "Buy" and "Sell"
         stock - The stock name or symbol
@@ -90,10 +50,13 @@ def transactions(records, prices):
     price : A dict with the following keys
         key - The stock name or symbol
         value - The current value of the stock
+    policy : The lot matching policy, 'fifo', 'lifo' or 'average' for average
+    cost, or a policy class from lotmatch
 
     OUTPUT
     ------
-    transactions :  A list of matched transactions with each transaction is a dict
+    transactions :  A list of matched transactions with each transaction is a dict,
+    or columnar.Lots when the records are columnar
         stock - The stock name or symbol (string)
         buy_date - The buy date of the transaction (datetime.date)
         buy_price - The buy price of the transaction (float)
@@ -104,27 +67,37 @@ def transactions(records, prices):
 
     """
 
-    records_by_stock = {}
-    for record in records:
-        stock = record['stock']
-        try:
-            record_list = records_by_stock[stock]
-        except KeyError:
-            record_list = []
-            records_by_stock[stock] = record_list
-        record_list.append(deepcopy(record))
+    with instrument.stage('transactions', len(records)):
+        if not isinstance(records, Records):
+            return _transactions_lots(Records.from_dicts(records), prices, policy).to_dicts()
+        return _transactions_lots(records, prices, policy)
+
+
+def _transactions_lots(records, prices, policy):
+    """
+    This function matches the columnar records of all the stocks as columnar.Lots.
+    It is used by the transactions function.
+    """
+    policy = get_policy(policy)
+    data = records.data
+    stocks = records.stocks
+    data = data[np.lexsort((-data['action'], data['date'], data['stock']))]
+    bounds = np.flatnonzero(np.diff(data['stock'])) + 1
+    today = date.today().toordinal()
 
     trans = []
-    for stock in records_by_stock:
-        stock_records = records_by_stock[stock]
+    for stock_records in np.split(data, bounds):
+        if len(stock_records) == 0:
+            continue
+        stock = stocks[stock_records['stock'][0]]
         try:
             price = prices[stock]
         except KeyError:
             price = 0.0
-        _trans = _transactions(stock_records, price)
+        _trans = _transactions(stock_records, price, today, policy)
         trans.extend(_trans)
 
-    return trans
+    return Lots.from_rows(trans, stocks)
 
 
 def cagr(transactions):
@@ -134,7 +107,8 @@ def cagr(transactions):
 
     INPUT
     -----
-    transactions :  A list of matched transactions with each transaction is a dict
+    transactions :  A list of matched transactions with each transaction is a dict,
+    or columnar.Lots
         stock - The stock name or symbol (string)
         buy_date - The buy date of the transaction (datetime.date)
         buy_price - The buy price of the transaction (float)
@@ -152,13 +126,32 @@ def cagr(transactions):
         cagr - Transaction level CAGR in decimal percentage (float)
 
     """
-    
-    for tran in transactions:
-        profit = tran['quantity'] * (tran['sell_price'] - tran['buy_price'])
-        pnl = profit / (tran['quantity'] * tran['buy_price'])
-        duration = ((tran['sell_date'] - tran['buy_date']).days)/365
-        cagr = ((tran['sell_price'] / tran['buy_price']) ** (1 / duration)) - 1
 
+    with instrument.stage('cagr', len(transactions)):
+        return _cagr_transactions(transactions)
+
+
+def _cagr_transactions(transactions):
+    """
+    This function enhances the matched transactions with the CAGR columns.
+    It is used by the cagr function.
+    """
+    if isinstance(transactions, Lots):
+        data = transactions.data
+        days = data['sell_date'] - data['buy_date']
+        data['profit'], data['pnl'], data['duration'], data['cagr'] = _cagr(
+            data['quantity'], data['buy_price'], data['sell_price'], days)
+        transactions.columns = lot_columns + cagr_columns
+        return transactions
+
+    count = len(transactions)
+    quantity = np.fromiter((tran['quantity'] for tran in transactions), dtype=np.float64, count=count)
+    buy_price = np.fromiter((tran['buy_price'] for tran in transactions), dtype=np.float64, count=count)
+    sell_price = np.fromiter((tran['sell_price'] for tran in transactions), dtype=np.float64, count=count)
+    days = np.fromiter(((tran['sell_date'] - tran['buy_date']).days for tran in transactions), dtype=np.int64, count=count)
+    columns = _cagr(quantity, buy_price, sell_price, days)
+
+    for tran, profit, pnl, duration, cagr in zip(transactions, *(column.tolist() for column in columns)):
         tran['profit'] = profit
         tran['pnl'] = pnl
         tran['duration'] = duration
@@ -166,6 +159,27 @@ def cagr(transactions):
 
     return transactions
 
+
+def _cagr(quantity, buy_price, sell_price, days):
+    """
+    This function calculates the profit, pnl, duration and CAGR columns of the
+    matched transactions. The pnl of a transaction with no investment and the CAGR
+    of a transaction bought and sold on the same day are 0.0.
+    It is used by the cagr function.
+    """
+    profit = quantity * (sell_price - buy_price)
+    investment = quantity * buy_price
+    pnl = np.divide(profit, investment, out=np.zeros_like(profit), where=investment != 0)
+    duration = days / 365
+
+    valid = (duration != 0) & (buy_price != 0)
+    ratio = np.divide(sell_price, buy_price, out=np.ones_like(profit), where=valid)
+    exponent = np.divide(1, duration, out=np.ones_like(profit), where=valid)
+    with np.errstate(over='ignore', invalid='ignore'):
+        cagr = np.where(valid, ratio ** exponent - 1, 0.0)
+
+    return profit, pnl, duration, cagr
+
 def pnl(transactions):
 
     """
@@ -173,7 +187,8 @@ def pnl(transactions):
 
     INPUT
     -----
-    transactions :  A list of matched transactions with each transaction is a dict
+    transactions :  A list of matched transactions with each transaction is a dict,
+    or columnar.Lots
         stock - The stock name or symbol (string)
         buy_date - The buy date of the transaction (datetime.date)
         buy_price - The buy price of the transaction (float)
@@ -193,117 +208,258 @@ def pnl(transactions):
             unrealized_pnl : % age realized profit on investment amound
     """
 
-    pnl = {}
+    with instrument.stage('pnl', len(transactions)):
+        return _pnl_transactions(transactions)
 
-    for tran in transactions:
 
-        stock = tran['stock']
-        try:
-            stock_pnl = pnl[stock]
-        except KeyError:
-            stock_pnl = {}
-            stock_pnl['realized'] = 0.0
-            stock_pnl['unrealized'] = 0.0
-            stock_pnl['realized_investment'] = 0.0
-            stock_pnl['unrealized_investment'] = 0.0
-            pnl[stock] = stock_pnl
+def _pnl_transactions(transactions):
+    """
+    This function aggregates the P&L columns of the matched transactions.
+    It is used by the pnl function.
+    """
+    if isinstance(transactions, Lots):
+        data = transactions.data
+        return _pnl(data['stock'], transactions.stocks, data['realized'],
+            data['profit'], data['buy_price'] * data['quantity'])
 
-        try:
-            total_pnl = pnl['TOTAL']
-        except KeyError:
-            total_pnl = {}
-            total_pnl['realized'] = 0.0
-            total_pnl['unrealized'] = 0.0
-            total_pnl['realized_investment'] = 0.0
-            total_pnl['unrealized_investment'] = 0.0   
-            pnl['TOTAL'] = total_pnl     
-        
-        if tran['realized']:
-            stock_pnl['realized'] += tran['profit']
-            stock_pnl['realized_investment'] += tran['buy_price'] * tran['quantity']
-            total_pnl['realized'] += tran['profit']
-            total_pnl['realized_investment'] += tran['buy_price'] * tran['quantity']
-        else:
-            stock_pnl['unrealized'] += tran['profit']
-            stock_pnl['unrealized_investment'] += tran['buy_price'] * tran['quantity']
-            total_pnl['unrealized'] += tran['profit']
-            total_pnl['unrealized_investment'] += tran['buy_price'] * tran['quantity']
-
-    for stock in pnl:
-        stock_pnl = pnl[stock]
-        stock_pnl['realized_pnl'] = 0.0 if stock_pnl['realized_investment'] == 0 else stock_pnl['realized'] / stock_pnl['realized_investment']
-        stock_pnl['unrealized_pnl'] = 0.0 if stock_pnl['unrealized_investment'] == 0 else stock_pnl['unrealized'] / stock_pnl['unrealized_investment']
+    count = len(transactions)
+    ids, stocks = intern_stocks(tran['stock'] for tran in transactions)
+    realized = np.fromiter((tran['realized'] for tran in transactions), dtype=bool, count=count)
+    profit = np.fromiter((tran['profit'] for tran in transactions), dtype=np.float64, count=count)
+    investment = np.fromiter((tran['buy_price'] * tran['quantity'] for tran in transactions), dtype=np.float64, count=count)
+
+    return _pnl(ids, stocks, realized, profit, investment)
+
+
+def _stock_pnl(realized, unrealized, realized_investment, unrealized_investment):
+    """
+    This function builds the P&L dict of a stock from the aggregated values.
+    """
+    stock_pnl = {}
+    stock_pnl['realized'] = float(realized)
+    stock_pnl['unrealized'] = float(unrealized)
+    stock_pnl['realized_investment'] = float(realized_investment)
+    stock_pnl['unrealized_investment'] = float(unrealized_investment)
+    stock_pnl['realized_pnl'] = 0.0 if realized_investment == 0 else stock_pnl['realized'] / stock_pnl['realized_investment']
+    stock_pnl['unrealized_pnl'] = 0.0 if unrealized_investment == 0 else stock_pnl['unrealized'] / stock_pnl['unrealized_investment']
+    return stock_pnl
+
+
+def _pnl(ids, stocks, realized, profit, investment):
+    """
+    This function calculates the total profit & loss from the columns of the matched
+    transactions. The per stock values are grouped reductions over the stock ids,
+    realized in the even and unrealized in the odd slots of each stock.
+    It is used by the pnl function.
+    """
+    if len(ids) == 0:
+        return {}
+    return _pnl_dict(stocks, *_pnl_aggregates(ids, len(stocks), realized, profit, investment))
+
+
+def _pnl_aggregates(ids, count, realized, profit, investment):
+    """
+    This function returns the realized and unrealized profits and investments of
+    each of count stocks as arrays of two columns, and the lot count of each stock.
+    The aggregates of disjoint lots can be added together.
+    """
+    slots = 2 * count
+    index = 2 * ids.astype(np.int64) + ~realized
+    profits = np.bincount(index, weights=profit, minlength=slots).reshape(-1, 2)
+    investments = np.bincount(index, weights=investment, minlength=slots).reshape(-1, 2)
+    lots = np.bincount(ids, minlength=count)
+    return profits, investments, lots
+
+
+def _pnl_dict(stocks, profits, investments, lots):
+    """
+    This function builds the P&L dict of the stocks with lots and the TOTAL from
+    the aggregates of _pnl_aggregates.
+    """
+    present = lots > 0
+    if not present.any():
+        return {}
+    pnl = {}
+    for stock_id in np.flatnonzero(present).tolist():
+        pnl[stocks[stock_id]] = _stock_pnl(profits[stock_id, 0], profits[stock_id, 1],
+            investments[stock_id, 0], investments[stock_id, 1])
+
+    profits = profits.sum(axis=0)
+    investments = investments.sum(axis=0)
+    pnl['TOTAL'] = _stock_pnl(profits[0], profits[1], investments[0], investments[1])
 
     return pnl
 
 
-def cashflow(records, prices):
+def cashflow(records, prices, today=None):
 
     """
     This function gives a cashflow based on trasaction records
 
     INPUT
     -----
-    record : A list of dictionary with the following keys
+    record : A list of dictionary with the following keys, or the same records
+    as columnar.Records
         date - Date in datetime.date format
         action - String either "Buy" and "Sell"
         stock - The stock name or symbol
         price - The buy or sell price
         quantity - The quantity of the transactions
-    prices : A dict of the current prices of stocks 
+    prices : A dict of the current prices of stocks, or None to leave out the
+    value of the holdings. The holdings of the stocks without a price are
+    valued at 0.0.
+    today : The datetime.date of the value of the holdings, today by default
 
     OUTPUT
     ------
     cashflow : A dict of cashflow records with positive records on sell and 
-    negetive on buy
+    negetive on buy sorted by date, or columnar.Cashflow when the records are
+    columnar, which xirr takes directly
         key : A datetime.date for the cashflow transaction
         value : Amount of transaction
 
     """
 
-    quantities = {}
-    cashflow = {}
+    with instrument.stage('cashflow', len(records)):
+        if not isinstance(records, Records):
+            return _cashflow(Records.from_dicts(records), prices, today).to_dict()
+        return _cashflow(records, prices, today)
 
-    for record in records:
+def stock_cashflows(records, prices, today=None):
+    """
+    This function gives the cashflow of each stock together with the total cashflow
+    of the records in the same pass. The input are the same as those of cashflow,
+    and the value of the holdings of each stock is added on today.
 
-        stock = record['stock']
-        try:
-            quantity = quantities[stock]
-        except KeyError:
-            quantity = 0
+    OUTPUT
+    ------
+    cashflows : columnar.StockCashflows of the flows sorted by stock and date, whose
+    total is the cashflow of all the stocks and whose cashflows are one
+    columnar.Cashflow per stock for xirr or cashflow_matrix
+    """
+    with instrument.stage('stock_cashflows', len(records)):
+        if not isinstance(records, Records):
+            records = Records.from_dicts(records)
+        ids, dates, amounts, held, stock_prices = _flow_arrays(records, prices)
+        if prices is not None:
+            today = (today or date.today()).toordinal()
+            holdings = np.flatnonzero(held)
+            ids = np.append(ids, holdings)
+            dates = np.append(dates, np.full(len(holdings), today))
+            amounts = np.append(amounts, held[holdings] * stock_prices[holdings])
+
+        keys, index = np.unique((ids.astype(np.int64) << 32) + dates, return_inverse=True)
+        amounts = np.bincount(index, weights=amounts, minlength=len(keys))
+        return StockCashflows(records.stocks, keys >> 32, keys & 0xffffffff, amounts)
+
+def _flow_arrays(records, prices):
+    """
+    This function returns the stock ids, day ordinals and amounts of the trades, and
+    the held quantity and the price of each stock, 0.0 when prices has no price.
+    """
+    data = records.data
+    data = data[data['action'] != 0]
+    stocks = records.stocks
 
-        try:
-            cashflow_item = cashflow[record['date']]
-        except KeyError:
-            cashflow_item = 0
+    signed_quantity = data['action'] * data['quantity']
+    amounts = -signed_quantity * data['price']
 
-        if record["action"] == 'Buy':
-            quantity += record["quantity"]
-            amount = -1 * record["quantity"] * record['price']
-            cashflow[record['date']] = cashflow_item + amount
+    held = None
+    stock_prices = None
+    if prices is not None:
+        held = np.bincount(data['stock'], weights=signed_quantity, minlength=len(stocks))
+        stock_prices = np.array([prices.get(stock, 0.0) for stock in stocks], dtype=np.float64)
+    return data['stock'], data['date'], amounts, held, stock_prices
 
-        elif record["action"] == 'Sell':
-            quantity -= record["quantity"]
-            amount = 1 * record["quantity"] * record['price']
-            cashflow[record['date']] = cashflow_item + amount
+def _cashflow(records, prices, today=None):
+    """
+    This function builds the columnar.Cashflow of columnar records.
+    It is used by the cashflow function.
+    """
+    ids, dates, amounts, held, stock_prices = _flow_arrays(records, prices)
 
-        quantities[stock] = quantity
+    if prices is not None:
+        cashflow_today = np.dot(held, stock_prices)
+        dates = np.append(dates, (today or date.today()).toordinal())
+        amounts = np.append(amounts, cashflow_today)
 
-    cashflow_today = 0
-    for stock in quantities:
-        cashflow_today += quantities[stock] * prices[stock]
+    dates, index = np.unique(dates, return_inverse=True)
+    amounts = np.bincount(index, weights=amounts, minlength=len(dates))
 
-    cashflow[date.today()] = cashflow_today
+    return Cashflow(dates, amounts)
 
-    return cashflow
+def _cashflow_arrays(cashflow):
+    """
+    This function converts a cashflow dict into the arrays used by the XIRR solver.
+    The day offsets are taken from the earliest date so the arrays are built once
+    per solve instead of once per iteration.
+    """
+    if isinstance(cashflow, Cashflow):
+        return cashflow.amounts, cashflow.offsets() / 365.
+
+    count = len(cashflow)
+    days = np.fromiter((d.toordinal() for d in cashflow.keys()), dtype=np.int64, count=count)
+    pmts = np.fromiter(cashflow.values(), dtype=np.float64, count=count)
+    if count == 0:
+        return pmts, np.zeros(0)
+    years = (days - days.min()) / 365.
+    return pmts, years
+
+def _discf(rate, pmts, years):
+    """
+    This function returns the discounted value of the cashflow and its derivative
+    with respect to the rate in a single vectorized pass.
+    """
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        discount = (1. + rate) ** (-years)
+        npv = np.dot(pmts, discount)
+        dnpv = -np.dot(pmts * years, discount) / (1. + rate)
+    return npv, dnpv
+
+_bracket_rates = np.concatenate((
+    -1. + np.logspace(-6, 0, 25, endpoint=False),
+    np.linspace(0., 1., 21),
+    np.logspace(0.1, 3, 15)))
+
+def _bracketed_xirr(pmts, years, guess):
+    """
+    This function is the fallback used when newton does not converge. It scans a
+    grid of rates for a sign change of the NPV and solves the bracket nearest to
+    the guess with brentq.
+    """
+    if not np.any(pmts):
+        raise RuntimeError('XIRR failed to converge, the cashflow has no payments')
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        npvs = np.dot((1. + _bracket_rates[:, None]) ** (-years[None, :]), pmts)
+
+    signs = np.sign(npvs)
+    valid = np.isfinite(npvs[:-1]) & np.isfinite(npvs[1:])
+    brackets = np.nonzero(valid & (signs[:-1] * signs[1:] <= 0))[0]
+    if len(brackets) == 0:
+        raise RuntimeError('XIRR failed to converge, the cashflow has no sign change in NPV')
 
-def _discf(rate, pmts, dates):
+    nearest = brackets[np.argmin(np.abs(_bracket_rates[brackets] - guess))]
+    low = _bracket_rates[nearest]
+    high = _bracket_rates[nearest + 1]
+    return brentq(lambda x: _discf(x, pmts, years)[0], low, high)
+
+def _newton(f, guess):
+    """
+    This function solves the rate with newton from the guess, f returns the NPV and
+    its derivative. It returns the rate and the number of iterations, the rate is
+    None when newton does not converge to a rate above -100%.
+    """
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        try:
+            result = root_scalar(f, x0=guess, fprime=True, method='newton')
+        except (ArithmeticError, ValueError):
+            return None, 0
 
-    dcf=[]
-    for i,cf in enumerate(pmts):
-        d=dates[i]-dates[0]
-        dcf.append(cf*(1+rate)**(-d.days/365.))
-    return np.add.reduce(dcf)
+    if result.converged and np.isfinite(result.root) and result.root > -1.:
+        return result.root, result.iterations
+    return None, result.iterations
 
 def xirr(cashflow, guess=.10):
     '''
@@ -311,10 +467,11 @@ def xirr(cashflow, guess=.10):
 
     Parameters
     ----------
-    values: array_like
-          Contains the cash flows including the initial investment
-    dates: array_like
-          Contains the dates of payments as in the form (year, month, day)
+    cashflow: dict
+          A dict of cashflow with datetime.date keys and the amount of the
+          payments as values, or a columnar.Cashflow
+    guess: float
+          The starting rate for the newton solver
 
     Returns: Float
           Internal Rate of Return
@@ -325,16 +482,226 @@ def xirr(cashflow, guess=.10):
 
     .. math:: \sum_{t=0}^M{\frac{v_t}{(1+xirr)^{(date_t-date_0)/365}}} = 0
 
+    The cashflow is converted to arrays once and newton is given the analytic
+    derivative. If newton does not converge the root is bracketed and solved
+    with brentq.
+
     '''
 
-    dates = list(cashflow.keys())
-    pmts = cashflow.values()
+    with instrument.stage('xirr', len(cashflow)):
+        pmts, years = _cashflow_arrays(cashflow)
+        if len(pmts) == 0:
+            instrument.solver('xirr', 0, 0, 0)
+            raise RuntimeError('XIRR failed to converge, the cashflow has no payments')
 
+        f = lambda x: _discf(x, pmts, years)
 
-    f = lambda x: _discf(x, pmts, dates)
+        rate, iterations = _newton(f, guess)
+        if rate is not None:
+            instrument.solver('xirr', iterations, 1, 0)
+            return rate
 
-    return newton(f, guess)
+        try:
+            rate = _bracketed_xirr(pmts, years, guess)
+        except RuntimeError:
+            instrument.solver('xirr', iterations, 0, 1)
+            raise
+        instrument.solver('xirr', iterations, 1, 1)
+        return rate
+
+def cashflow_matrix(cashflows):
+    """
+    This function converts a list of cashflow dicts into the padded arrays used by
+    xirr_batch.
 
+    INPUT
+    -----
+    cashflows : A list of cashflow dicts with datetime.date keys and amounts as values,
+    or of columnar.Cashflow such as the cashflows of stock_cashflows
 
+    OUTPUT
+    ------
+    pmts : A 2-D array of amounts, one row per cashflow, padded with 0.0
+    years : A 2-D array of year offsets from the earliest date of each row
+    mask : A 2-D boolean array which is True for the actual cashflow entries
+    """
+    width = max((len(cashflow) for cashflow in cashflows), default=0)
+    pmts = np.zeros((len(cashflows), width))
+    years = np.zeros((len(cashflows), width))
+    mask = np.zeros((len(cashflows), width), dtype=bool)
+
+    for i, cashflow in enumerate(cashflows):
+        count = len(cashflow)
+        if count == 0:
+            continue
+        pmts[i, :count], years[i, :count] = _cashflow_arrays(cashflow)
+        mask[i, :count] = True
+
+    return pmts, years, mask
+
+def xirr_batch(pmts, years, mask=None, guess=.10, tol=1.48e-08, maxiter=50):
+    """
+    This function solves the XIRR of many cashflows together. Newton steps are taken
+    for all the unsolved cashflows at once, and the cashflows where newton does not
+    converge are solved with the same bracketed fallback as xirr.
+
+    INPUT
+    -----
+    pmts : A 2-D array of amounts with one row per cashflow
+    years : A 2-D array of year offsets from the first date of each row
+    mask : Optional 2-D boolean array which is False for the padded entries
+    guess : The starting rate, either a float or an array with one rate per row
+    tol : The tolerance on the newton step
+    maxiter : The maximum number of newton iterations
+
+    OUTPUT
+    ------
+    rates : An array of XIRR, one per row, nan when the row could not be solved
+    converged : A boolean array which is True when the rate of the row was solved
+    """
+    with instrument.stage('xirr_batch', len(pmts)):
+        pmts = np.asarray(pmts, dtype=np.float64)
+        years = np.asarray(years, dtype=np.float64)
+        if mask is not None:
+            pmts = np.where(mask, pmts, 0.)
+
+        count = pmts.shape[0]
+        rates = np.empty(count)
+        rates[:] = guess
+        converged = np.zeros(count, dtype=bool)
+        active = np.arange(count)
+        iterations = 0
+
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            for _ in range(maxiter):
+                if len(active) == 0:
+                    break
+                iterations += len(active)
+                rate = rates[active]
+                discount = (1. + rate[:, None]) ** (-years[active])
+                npv = np.einsum('ij,ij->i', pmts[active], discount)
+                dnpv = -np.einsum('ij,ij->i', pmts[active] * years[active], discount) / (1. + rate)
+                step = npv / dnpv
+                rate = rate - step
+                rates[active] = rate
+
+                diverged = ~np.isfinite(rate) | (rate <= -1.)
+                done = ~diverged & (np.abs(step) < tol)
+                converged[active[done]] = True
+                active = active[~done & ~diverged]
+
+        newton_converged = int(converged.sum())
+        for i in np.nonzero(~converged)[0]:
+            row = pmts[i] if mask is None else pmts[i][mask[i]]
+            row_years = years[i] if mask is None else years[i][mask[i]]
+            start = guess if np.isscalar(guess) else guess[i]
+            try:
+                rates[i] = _bracketed_xirr(row, row_years, start)
+                converged[i] = True
+            except (RuntimeError, ValueError):
+                rates[i] = np.nan
+
+        instrument.solver('xirr_batch', iterations, int(converged.sum()), count - newton_converged, count)
+
+        return rates, converged
+
+
+def _sorted_cashflow(cashflow):
+    """
+    This function returns the day ordinals and amounts of a cashflow sorted by date.
+    """
+    if isinstance(cashflow, Cashflow):
+        days = np.asarray(cashflow.dates, dtype=np.int64)
+        amounts = np.asarray(cashflow.amounts, dtype=np.float64)
+    else:
+        count = len(cashflow)
+        days = np.fromiter((d.toordinal() for d in cashflow.keys()), dtype=np.int64, count=count)
+        amounts = np.fromiter(cashflow.values(), dtype=np.float64, count=count)
+    order = np.argsort(days, kind='stable')
+    return days[order], amounts[order]
+
+def xirr_series(cashflow, dates, valuations, window=None, guess=.10):
+    """
+    This function calculates the XIRR as of each of a series of valuation dates.
+
+    INPUT
+    -----
+    cashflow : The cashflow of the trades without the value of the holdings, a dict
+    of datetime.date and amount or a columnar.Cashflow, e.g. cashflow(records, None)
+    dates : A list of the valuation dates (datetime.date) in ascending order
+    valuations : The value of the holdings on each of the valuation dates
+    window : Optional trailing window in days, e.g. 365 for the 1Y XIRR. The value
+    of the holdings on the latest valuation date on or before the window start is
+    the initial investment of the window. When there is no such valuation date the
+    XIRR is calculated since inception.
+    guess : The starting rate of the first solve
 
+    OUTPUT
+    ------
+    rates : An array of the XIRR as of each of the valuation dates, nan when the
+    cashflow up to the date has no solution
 
+    Each solve starts from the rate of the previous date. The prefix sums of the
+    inflows and outflows give the totals of any window without a scan, so windows
+    without both inflows and outflows are skipped without a solve.
+    """
+    with instrument.stage('xirr_series', len(dates)):
+        flow_days, amounts = _sorted_cashflow(cashflow)
+        inflows = np.concatenate(([0.], np.cumsum(np.where(amounts > 0, amounts, 0.))))
+        outflows = np.concatenate(([0.], np.cumsum(np.where(amounts < 0, amounts, 0.))))
+
+        valuation_days = np.array([d.toordinal() for d in dates], dtype=np.int64)
+        valuations = np.asarray(valuations, dtype=np.float64)
+        rates = np.full(len(valuation_days), np.nan)
+        rate = guess
+
+        for k in range(len(valuation_days)):
+            day = valuation_days[k]
+            value = valuations[k]
+            end = np.searchsorted(flow_days, day, side='right')
+            start = 0
+            initial = 0.
+            first_day = flow_days[0] if end > 0 else day
+
+            if window is not None:
+                index = np.searchsorted(valuation_days, day - window, side='right') - 1
+                if index >= 0:
+                    first_day = valuation_days[index]
+                    initial = -valuations[index]
+                    start = np.searchsorted(flow_days, first_day, side='right')
+
+            inflow = inflows[end] - inflows[start] + max(value, 0.) + max(initial, 0.)
+            outflow = outflows[end] - outflows[start] + min(value, 0.) + min(initial, 0.)
+            if inflow == 0 or outflow == 0:
+                continue
+
+            pmts = amounts[start:end]
+            years = (flow_days[start:end] - first_day) / 365.
+            value_years = (day - first_day) / 365.
+
+            def f(x):
+                npv, dnpv = _discf(x, pmts, years)
+                with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+                    discount = (1. + x) ** (-value_years)
+                    npv += initial + value * discount
+                    dnpv -= value * value_years * discount / (1. + x)
+                return npv, dnpv
+
+            start_rate = rate if np.isfinite(rate) else guess
+            newton_rate, iterations = _newton(f, start_rate)
+            if newton_rate is not None:
+                rate = newton_rate
+                instrument.solver('xirr_series', iterations, 1, 0)
+            else:
+                window_pmts = np.concatenate(([initial], pmts, [value]))
+                window_years = np.concatenate(([0.], years, [value_years]))
+                try:
+                    rate = _bracketed_xirr(window_pmts, window_years, start_rate)
+                    instrument.solver('xirr_series', iterations, 1, 1)
+                except (RuntimeError, ValueError):
+                    instrument.solver('xirr_series', iterations, 0, 1)
+                    continue
+
+            rates[k] = rate
+
+        return rates
@@ -0,0 +1,253 @@
+from datetime import date
+import numpy as np
+
+BUY = 1
+SELL = -1
+
+actions = {'Buy': BUY, 'Sell': SELL}
+action_names = {BUY: 'Buy', SELL: 'Sell'}
+
+record_dtype = np.dtype([
+    ('date', np.int64),
+    ('action', np.int8),
+    ('stock', np.int32),
+    ('quantity', np.float64),
+    ('price', np.float64)])
+
+lot_dtype = np.dtype([
+    ('stock', np.int32),
+    ('buy_date', np.int64),
+    ('buy_price', np.float64),
+    ('sell_date', np.int64),
+    ('sell_price', np.float64),
+    ('realized', np.bool_),
+    ('quantity', np.float64),
+    ('profit', np.float64),
+    ('pnl', np.float64),
+    ('duration', np.float64),
+    ('cagr', np.float64)])
+
+lot_columns = ['stock', 'buy_date', 'buy_price', 'sell_date', 'sell_price', 'realized', 'quantity']
+cagr_columns = ['profit', 'pnl', 'duration', 'cagr']
+
+
+def intern_stocks(names, stocks=None):
+    """
+    This function interns the stock names as integer ids.
+    The inout are as follows:
+        names - An iterable of stock names or symbols
+        stocks - Optional list of already interned names, it is extended in place
+    It returns an array of ids which index into the stocks list, and the stocks list.
+    """
+    if stocks is None:
+        stocks = []
+    index = {stock: i for i, stock in enumerate(stocks)}
+    ids = []
+    for name in names:
+        try:
+            stock_id = index[name]
+        except KeyError:
+            stock_id = len(stocks)
+            index[name] = stock_id
+            stocks.append(name)
+        ids.append(stock_id)
+    return np.array(ids, dtype=np.int32), stocks
+
+
+class Records:
+    """
+    Columnar transaction records. The data is a structured array of record_dtype
+    with the dates stored as day ordinals and the stocks as ids into the stocks list.
+    """
+
+    __slots__ = ('data', 'stocks')
+
+    def __init__(self, data, stocks):
+        self.data = data
+        self.stocks = stocks
+
+    def __len__(self):
+        return len(self.data)
+
+    @classmethod
+    def from_dicts(cls, records, stocks=None):
+        """
+        This function builds the columnar records from a list of record dicts with
+        the keys date, action, stock, quantity and price.
+        """
+        data = np.empty(len(records), dtype=record_dtype)
+        ids, stocks = intern_stocks((record['stock'] for record in records), stocks)
+        data['stock'] = ids
+        data['date'] = [record['date'].toordinal() for record in records]
+        data['action'] = [actions.get(record['action'], 0) for record in records]
+        data['quantity'] = [float(record['quantity']) for record in records]
+        data['price'] = [float(record['price']) for record in records]
+        return cls(data, stocks)
+
+    def to_dicts(self):
+        """
+        This function returns the records as a list of record dicts.
+        """
+        records = []
+        for day, action, stock, quantity, price in self.data.tolist():
+            record = {}
+            record['date'] = date.fromordinal(day)
+            record['action'] = action_names.get(action)
+            record['stock'] = self.stocks[stock]
+            record['quantity'] = quantity
+            record['price'] = price
+            records.append(record)
+        return records
+
+
+class Lots:
+    """
+    Columnar matched transactions. The data is a structured array of lot_dtype and
+    the columns lists the fields which have been calculated.
+    """
+
+    __slots__ = ('data', 'stocks', 'columns')
+
+    def __init__(self, data, stocks, columns=lot_columns):
+        self.data = data
+        self.stocks = stocks
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.data)
+
+    @classmethod
+    def from_rows(cls, trans, stocks):
+        """
+        This function builds the columnar lots from a list of matched transaction tuples
+        of stock id, buy date, buy price, sell date, sell price, realized and quantity.
+        """
+        data = np.empty(len(trans), dtype=lot_dtype)
+        for column, values in zip(lot_columns, zip(*trans)):
+            data[column] = values
+        for column in cagr_columns:
+            data[column] = np.nan
+        return cls(data, stocks)
+
+    @classmethod
+    def from_dicts(cls, trans, stocks=None):
+        """
+        This function builds the columnar lots from a list of matched transaction
+        dicts of calculator.transactions, or of cagr with the CAGR columns.
+        """
+        data = np.empty(len(trans), dtype=lot_dtype)
+        ids, stocks = intern_stocks((tran['stock'] for tran in trans), stocks)
+        data['stock'] = ids
+        data['buy_date'] = [tran['buy_date'].toordinal() for tran in trans]
+        data['sell_date'] = [tran['sell_date'].toordinal() for tran in trans]
+        for column in ('buy_price', 'sell_price', 'realized', 'quantity'):
+            data[column] = [tran[column] for tran in trans]
+        if len(trans) > 0 and all(column in trans[0] for column in cagr_columns):
+            for column in cagr_columns:
+                data[column] = [tran[column] for tran in trans]
+            return cls(data, stocks, lot_columns + cagr_columns)
+        for column in cagr_columns:
+            data[column] = np.nan
+        return cls(data, stocks)
+
+    def to_dicts(self):
+        """
+        This function returns the matched transactions as a list of dicts with the
+        same keys as the dict based calculator functions.
+        """
+        columns = self.columns
+        stocks = self.stocks
+        dates = {'buy_date', 'sell_date'}
+        trans = []
+        for row in self.data[columns].tolist():
+            tran = {}
+            for column, value in zip(columns, row):
+                if column == 'stock':
+                    value = stocks[value]
+                elif column in dates:
+                    value = date.fromordinal(value)
+                tran[column] = value
+            trans.append(tran)
+        return trans
+
+
+class Cashflow:
+    """
+    Columnar cashflow with the dates as sorted day ordinals and the amounts
+    of the cashflow on each of the dates.
+    """
+
+    __slots__ = ('dates', 'amounts')
+
+    def __init__(self, dates, amounts):
+        self.dates = dates
+        self.amounts = amounts
+
+    def __len__(self):
+        return len(self.dates)
+
+    def to_dict(self):
+        """
+        This function returns the cashflow as a dict of datetime.date and amount.
+        """
+        return {date.fromordinal(day): amount for day, amount in zip(self.dates.tolist(), self.amounts.tolist())}
+
+    def offsets(self):
+        """
+        This function returns the integer day offsets of the dates from the first date.
+        """
+        if len(self.dates) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.dates - self.dates.min()
+
+
+class StockCashflows:
+    """
+    Columnar cashflows of many stocks. The ids, dates and amounts are sorted by
+    stock id and date, and the rows of the stock id i are bounds[i]:bounds[i + 1].
+    """
+
+    __slots__ = ('stocks', 'ids', 'dates', 'amounts', 'bounds')
+
+    def __init__(self, stocks, ids, dates, amounts):
+        self.stocks = stocks
+        self.ids = ids
+        self.dates = dates
+        self.amounts = amounts
+        self.bounds = np.searchsorted(ids, np.arange(len(stocks) + 1))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def cashflow(self, stock):
+        """
+        This function returns the Cashflow of a stock name, which is empty when the
+        stock has no flows.
+        """
+        try:
+            i = self.stocks.index(stock)
+        except ValueError:
+            return Cashflow(np.zeros(0, dtype=np.int64), np.zeros(0))
+        rows = slice(self.bounds[i], self.bounds[i + 1])
+        return Cashflow(self.dates[rows], self.amounts[rows])
+
+    def cashflows(self):
+        """
+        This function returns the list of the Cashflow of each stock in the order of
+        the stocks.
+        """
+        return [Cashflow(self.dates[start:end], self.amounts[start:end])
+            for start, end in zip(self.bounds[:-1].tolist(), self.bounds[1:].tolist())]
+
+    def total(self):
+        """
+        This function returns the Cashflow of all the stocks.
+        """
+        dates, index = np.unique(self.dates, return_inverse=True)
+        return Cashflow(dates, np.bincount(index, weights=self.amounts, minlength=len(dates)))
+
+    def to_dict(self):
+        """
+        This function returns a dict of the cashflow dict of each stock with flows.
+        """
+        return {stock: flows.to_dict() for stock, flows in zip(self.stocks, self.cashflows()) if len(flows) > 0}
@@ -1,9 +1,21 @@
 import csv
 import os
 import datetime
+import fnmatch
+import functools
+import gzip
+import io
+import json
+import numpy as np
+from . import instrument
+from .ingest import ingest_files
+from .columnar import Records, Lots, record_dtype, lot_dtype, lot_columns, cagr_columns, actions, action_names, intern_stocks
+from .pricestore import PriceStore, price_history_dtype
 
 records_cols={'date':'date', 'action':'action', 'stock':'stock', 'quantity':'quantity', 'price':'price'}
 prices_cols={'stock':'stock', 'price':'price'}
+price_history_cols={'date':'date', 'stock':'stock', 'price':'price'}
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
 
 def parse_records_file(filename, columns=records_cols):
     """
@@ -12,7 +24,7 @@ def parse_records_file(filename, columns=records_cols):
         filename - Full qualified of the input file
         columns - Optional dict field to map the CSV header columns to actual ones
     """
-    with open(filename) as csvfile:
+    with instrument.stage('parse_records_file') as stage, open(filename) as csvfile:
         preader = csv.DictReader(csvfile)
         records = []
         for row in preader:
@@ -23,6 +35,7 @@ def parse_records_file(filename, columns=records_cols):
             record['quantity'] = row.get(columns['quantity'])
             record['price'] = row.get(columns['price'])
             records.append(record)
+        stage.count(len(records))
         return records
 
 def parse_prices_file(filename, columns=prices_cols):
@@ -32,13 +45,393 @@ def parse_prices_file(filename, columns=prices_cols):
         filename - Full qualified of the input file
         columns - Optional dict field to map the CSV header columns to actual ones
     """
-    with open(filename) as csvfile:
+    with instrument.stage('parse_prices_file') as stage, open(filename) as csvfile:
         preader = csv.DictReader(csvfile)
         prices = {}
         for row in preader:
             prices[row.get(columns['stock'])] = float(row.get(columns['price']))
+        stage.count(len(prices))
         return prices
 
+def _open_output(filepath, compress=False):
+    """
+    This function opens an output CSV file for writing, gzip compressed with compress.
+    """
+    if compress:
+        return gzip.open(filepath, 'wt', newline='')
+    return open(filepath, 'w', newline='')
+
+def _iso_dates(ordinals):
+    """
+    This function converts an array of day ordinals into a list of ISO date strings.
+    """
+    days = np.asarray(ordinals, dtype=np.int64) - epoch_ordinal
+    return days.astype('datetime64[D]').astype(str).tolist()
+
+def write_columns(filepath, header, columns, compress=False, chunksize=100000):
+    """
+    This function writes the columns of a table into a CSV file in chunks of rows.
+    The inout are as follows:
+        filepath - Full qualified path of the output file
+        header - The list of column names
+        columns - A list of functions, one per column, which take a slice and return
+        the list of values of the column for the slice
+        compress - Optional flag to write a gzip compressed file
+        chunksize - The number of rows converted and written at a time
+    The columns are converted a chunk at a time and written with a single writerows call.
+    """
+    with _open_output(filepath, compress) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        start = 0
+        while True:
+            rows = slice(start, start + chunksize)
+            values = [column(rows) for column in columns]
+            if len(values) == 0 or len(values[0]) == 0:
+                break
+            writer.writerows(zip(*values))
+            start += chunksize
+
+def write_lots(lots, filepath, format='csv', compress=False, chunksize=100000):
+    """
+    This function exports matched transactions without modifying them.
+    The inout are as follows:
+        lots - columnar.Lots, as returned by calculator.transactions and cagr
+        filepath - Full qualified path of the output file, or of the cache folder
+        for the npy format
+        format - 'csv' for a CSV file with the columns of map_cagr_transactions_file,
+        or 'npy' for the binary columnar cache format
+        compress - Optional flag to gzip the CSV file
+        chunksize - The number of rows converted and written at a time
+    """
+    data = lots.data
+    if format == 'npy':
+        _save_columnar(filepath, 'lots', data, lots.stocks)
+        return
+    if format != 'csv':
+        raise ValueError('Unknown export format %s, expected csv or npy' % format)
+
+    stocks = np.array(lots.stocks + [''], dtype=object)
+    columns = []
+    for column in lots.columns:
+        if column == 'stock':
+            columns.append(lambda rows: stocks[data['stock'][rows]].tolist())
+        elif column in ('buy_date', 'sell_date'):
+            columns.append(lambda rows, column=column: _iso_dates(data[column][rows]))
+        else:
+            columns.append(lambda rows, column=column: data[column][rows].tolist())
+    write_columns(filepath, list(lots.columns), columns, compress, chunksize)
+
+def write_records(records, filepath, format='csv', compress=False, chunksize=100000):
+    """
+    This function exports columnar.Records as a CSV file with the records_cols
+    columns, or as the binary records cache with the npy format.
+    """
+    data = records.data
+    if format == 'npy':
+        save_records_cache(records, filepath)
+        return
+    if format != 'csv':
+        raise ValueError('Unknown export format %s, expected csv or npy' % format)
+
+    stocks = np.array(records.stocks + [''], dtype=object)
+    columns = [lambda rows: _iso_dates(data['date'][rows]),
+        lambda rows: [action_names.get(action) for action in data['action'][rows].tolist()],
+        lambda rows: stocks[data['stock'][rows]].tolist(),
+        lambda rows: data['quantity'][rows].tolist(),
+        lambda rows: data['price'][rows].tolist()]
+    header = [records_cols[key] for key in ('date', 'action', 'stock', 'quantity', 'price')]
+    write_columns(filepath, header, columns, compress, chunksize)
+
+def write_cashflow(cashflow, filepath, compress=False):
+    """
+    This function exports a columnar.Cashflow as a CSV file with the columns of
+    map_cashflows.
+    """
+    columns = [lambda rows: _iso_dates(cashflow.dates[rows]),
+        lambda rows: np.asarray(cashflow.amounts)[rows].tolist()]
+    write_columns(filepath, ['date', 'cashflow'], columns, compress)
+
+def write_pnl(pnl, filepath, compress=False):
+    """
+    This function exports the P&L dict of calculator.pnl as a CSV file with the
+    columns of map_pnl, without modifying the dict.
+    """
+    csv_columns = ['realized','realized_investment','realized_pnl','unrealized','unrealized_investment','unrealized_pnl']
+    stocks = [stock for stock in pnl if stock != 'TOTAL'] + (['TOTAL'] if 'TOTAL' in pnl else [])
+    with _open_output(filepath, compress) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['stock'] + csv_columns)
+        writer.writerows([str(stock)] + [pnl[stock][column] for column in csv_columns] for stock in stocks)
+
+def _date_parser(date_format=None):
+    """
+    This function returns a memoized parser of the date strings of a CSV file.
+    ISO dates are parsed with date.fromisoformat, any other format with strptime.
+    """
+    dates = {}
+
+    def parse_date(value):
+        try:
+            return dates[value]
+        except KeyError:
+            if date_format is None:
+                parsed = datetime.date.fromisoformat(value.strip())
+            else:
+                parsed = datetime.datetime.strptime(value.strip(), date_format).date()
+            dates[value] = parsed
+            return parsed
+
+    return parse_date
+
+def _column_index(header, columns, keys, filename):
+    """
+    This function maps the keys to the positions of the mapped columns in the header.
+    """
+    try:
+        return [header.index(columns[key]) for key in keys]
+    except ValueError:
+        missing = [columns[key] for key in keys if columns[key] not in header]
+        raise ValueError('%s does not have the columns %s' % (filename, ', '.join(missing)))
+
+def _iter_rows(filename, columns, keys, chunksize):
+    """
+    This function streams the mapped columns of the rows of a CSV file in chunks
+    of lists of values in the order of the keys.
+    """
+    with open(filename, newline='') as csvfile:
+        yield from _iter_csv_rows(csvfile, columns, keys, chunksize, filename)
+
+def _iter_csv_rows(csvfile, columns, keys, chunksize, filename):
+    preader = csv.reader(csvfile)
+    try:
+        header = next(preader)
+    except StopIteration:
+        return
+    index = _column_index(header, columns, keys, filename)
+    chunk = []
+    for row in preader:
+        if len(row) == 0:
+            continue
+        chunk.append([row[i] for i in index])
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def iter_records_file(filename, columns=records_cols, chunksize=100000, date_format=None):
+    """
+    This function streams a CSV file of transaction records in chunks. Each chunk is a
+    list of records with the date as datetime.date and the quantity and price as float.
+    The inout are as follows:
+        filename - Full qualified of the input file
+        columns - Optional dict field to map the CSV header columns to actual ones
+        chunksize - The maximum number of records in a chunk
+        date_format - Optional strptime format of the dates, ISO dates by default
+    """
+    parse_date = _date_parser(date_format)
+    keys = ['date', 'action', 'stock', 'quantity', 'price']
+    for rows in _iter_rows(filename, columns, keys, chunksize):
+        records = []
+        for date_str, action, stock, quantity, price in rows:
+            record = {}
+            record['date'] = parse_date(date_str)
+            record['action'] = action
+            record['stock'] = stock
+            record['quantity'] = float(quantity)
+            record['price'] = float(price)
+            records.append(record)
+        yield records
+
+def read_records_columnar(filename, columns=records_cols, chunksize=100000, date_format=None):
+    """
+    This function reads a CSV file of transaction records directly into columnar.Records
+    without building a dict per record.
+    The inout are as follows:
+        filename - Full qualified of the input file
+        columns - Optional dict field to map the CSV header columns to actual ones
+        chunksize - The number of rows converted to arrays at a time
+        date_format - Optional strptime format of the dates, ISO dates by default
+    """
+    with instrument.stage('read_records_columnar') as stage:
+        records = _read_records_columnar(filename, columns, chunksize, date_format)
+        stage.count(len(records))
+        return records
+
+def _read_records_columnar(filename, columns, chunksize, date_format):
+    keys = ['date', 'action', 'stock', 'quantity', 'price']
+    return _records_from_chunks(_iter_rows(filename, columns, keys, chunksize), date_format)
+
+def parse_records_data(filename, data, columns=records_cols, chunksize=100000, date_format=None):
+    """
+    This function parses the bytes of a CSV file of transaction records, which have
+    already been read, into columnar.Records like read_records_columnar.
+    """
+    keys = ['date', 'action', 'stock', 'quantity', 'price']
+    with instrument.stage('parse_records_data') as stage:
+        csvfile = io.TextIOWrapper(io.BytesIO(data), newline='')
+        records = _records_from_chunks(_iter_csv_rows(csvfile, columns, keys, chunksize, filename), date_format)
+        stage.count(len(records))
+        return records
+
+def read_records_files(filelist, columns=records_cols, date_format=None, io_limit=16, workers=1):
+    """
+    This function reads many CSV files of transaction records concurrently and
+    returns a list of columnar.Records in the order of the list.
+    The inout are as follows:
+        filelist - A list of records files
+        columns - Optional dict field to map the CSV header columns to actual ones
+        date_format - Optional strptime format of the dates, ISO dates by default
+        io_limit - The maximum number of files read at a time
+        workers - The number of worker processes parsing the files
+    """
+    process = functools.partial(parse_records_data, columns=columns, date_format=date_format)
+    return ingest_files(filelist, process, io_limit, workers)
+
+def _records_from_chunks(chunks_of_rows, date_format):
+    parse_date = _date_parser(date_format)
+    stocks = []
+    chunks = []
+    for rows in chunks_of_rows:
+        date_strs, action_strs, names, quantities, prices = zip(*rows)
+        data = np.empty(len(rows), dtype=record_dtype)
+        data['date'] = [parse_date(value).toordinal() for value in date_strs]
+        data['action'] = [actions.get(action, 0) for action in action_strs]
+        data['stock'] = intern_stocks(names, stocks)[0]
+        data['quantity'] = np.array(quantities, dtype=np.float64)
+        data['price'] = np.array(prices, dtype=np.float64)
+        chunks.append(data)
+
+    if len(chunks) == 0:
+        return Records(np.empty(0, dtype=record_dtype), stocks)
+    return Records(np.concatenate(chunks), stocks)
+
+def iter_prices_file(filename, columns=prices_cols, chunksize=100000):
+    """
+    This function streams a CSV file of prices in chunks. Each chunk is a dict of
+    the stock and its price as float.
+    The inout are as follows:
+        filename - Full qualified of the input file
+        columns - Optional dict field to map the CSV header columns to actual ones
+        chunksize - The maximum number of prices in a chunk
+    """
+    for rows in _iter_rows(filename, columns, ['stock', 'price'], chunksize):
+        yield {stock: float(price) for stock, price in rows}
+
+def _save_columnar(filepath, name, data, stocks):
+    """
+    This function saves an array and its stock names in a cache folder as a .npy
+    file and a JSON string table.
+    """
+    os.makedirs(filepath, exist_ok=True)
+    np.save(os.path.join(filepath, name + '.npy'), data, allow_pickle=False)
+    with open(os.path.join(filepath, name + '.json'), 'w') as jsonfile:
+        json.dump(stocks, jsonfile)
+
+def _load_columnar(filepath, name, mmap=True, mmap_mode='r'):
+    """
+    This function loads an array and its stock names saved with _save_columnar,
+    the array is memory mapped with mmap_mode, read only by default, unless mmap
+    is False.
+    """
+    data = np.load(os.path.join(filepath, name + '.npy'), mmap_mode=mmap_mode if mmap else None, allow_pickle=False)
+    with open(os.path.join(filepath, name + '.json')) as jsonfile:
+        stocks = json.load(jsonfile)
+    return data, stocks
+
+def save_records_cache(records, filepath):
+    """
+    This function saves transaction records in a binary cache folder.
+    The inout are as follows:
+        records - A list of record dicts or columnar.Records
+        filepath - Full qualified path of the cache folder
+    """
+    if not isinstance(records, Records):
+        records = Records.from_dicts(records)
+    _save_columnar(filepath, 'records', records.data, records.stocks)
+
+def load_records_cache(filepath, mmap=True):
+    """
+    This function loads the transaction records saved with save_records_cache as
+    columnar.Records, which the calculator functions take directly. The records
+    are memory mapped read only unless mmap is False.
+    """
+    data, stocks = _load_columnar(filepath, 'records', mmap)
+    if data.dtype != record_dtype:
+        raise ValueError('%s is not a records cache' % filepath)
+    return Records(data, stocks)
+
+def load_lots_cache(filepath, mmap=True):
+    """
+    This function loads the matched transactions saved by write_lots with the npy
+    format as columnar.Lots, memory mapped unless mmap is False. The lots are mapped
+    copy on write, so that calculator.cagr can fill in their CAGR columns without
+    changing the cache.
+    """
+    data, stocks = _load_columnar(filepath, 'lots', mmap, 'c')
+    if data.dtype != lot_dtype:
+        raise ValueError('%s is not a lots cache' % filepath)
+    columns = lot_columns
+    if len(data) > 0 and not np.isnan(data['cagr']).all():
+        columns = lot_columns + cagr_columns
+    return Lots(data, stocks, columns)
+
+def save_prices_cache(prices, filepath):
+    """
+    This function saves a dict of stock prices in a binary cache folder.
+    """
+    _save_columnar(filepath, 'prices', np.array(list(prices.values()), dtype=np.float64), list(prices))
+
+def load_prices_cache(filepath, mmap=True):
+    """
+    This function loads the dict of stock prices saved with save_prices_cache.
+    """
+    data, stocks = _load_columnar(filepath, 'prices', mmap)
+    return dict(zip(stocks, data.tolist()))
+
+def read_price_history(filename, columns=price_history_cols, chunksize=100000, date_format=None):
+    """
+    This function reads a CSV file of the historical prices of stocks into a
+    pricestore.PriceStore for as of lookups.
+    The inout are as follows:
+        filename - Full qualified of the input file
+        columns - Optional dict field to map the CSV header columns to actual ones
+        chunksize - The number of rows converted to arrays at a time
+        date_format - Optional strptime format of the dates, ISO dates by default
+    """
+    parse_date = _date_parser(date_format)
+    stocks = []
+    ids = []
+    dates = []
+    prices = []
+    for rows in _iter_rows(filename, columns, ['stock', 'date', 'price'], chunksize):
+        names, date_strs, price_strs = zip(*rows)
+        ids.append(intern_stocks(names, stocks)[0])
+        dates.append(np.array([parse_date(value).toordinal() for value in date_strs], dtype=np.int64))
+        prices.append(np.array(price_strs, dtype=np.float64))
+
+    if len(ids) == 0:
+        return PriceStore(stocks, [], [], [])
+    return PriceStore(stocks, np.concatenate(ids), np.concatenate(dates), np.concatenate(prices))
+
+def save_price_history_cache(store, filepath):
+    """
+    This function saves a pricestore.PriceStore in a binary cache folder.
+    """
+    data = np.empty(len(store), dtype=price_history_dtype)
+    data['stock'] = store.ids
+    data['date'] = store.dates
+    data['price'] = store.prices
+    _save_columnar(filepath, 'price_history', data, store.stocks)
+
+def load_price_history_cache(filepath, mmap=True):
+    """
+    This function loads the pricestore.PriceStore saved with save_price_history_cache.
+    """
+    data, stocks = _load_columnar(filepath, 'price_history', mmap)
+    return PriceStore(stocks, data['stock'], data['date'], data['price'])
+
 def map_transactions_file(transactions, filepath):
     """
     This function take the mapped transactions at transaction level
@@ -91,18 +484,16 @@ def map_cagr_transactions_file(transactions, filepath):
 def map_pnl(pnl, filepath):
     """
     This transaction maps the pnl for each fo ths stocks
+    The pnl dict is not modified.
     """
     csv_columns = ['stock','realized','realized_investment','realized_pnl','unrealized','unrealized_investment','unrealized_pnl']
     with open(filepath, 'w') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
         writer.writeheader()
-        total_pnl = pnl.pop('TOTAL')
-        total_pnl['stock'] = 'TOTAL'
         for stock in pnl:
-            stock_pnl = pnl[stock]
-            stock_pnl['stock'] = str(stock)
-            writer.writerow(stock_pnl)
-        writer.writerow(total_pnl)
+            if stock != 'TOTAL':
+                writer.writerow(dict(pnl[stock], stock=str(stock)))
+        writer.writerow(dict(pnl['TOTAL'], stock='TOTAL'))
 
 
 def map_cashflows(cashflow, filepath):
@@ -118,16 +509,59 @@ def map_cashflows(cashflow, filepath):
             writer.writerow(item)
     
 
-def list_csv_files(filepath):
-    filelist = []
-    for parent_folder_path in os.listdir(filepath):
-        parent_folder = os.path.join(filepath, parent_folder_path)
-        if os.path.isdir(parent_folder):
-            for csv_file_path in os.listdir(parent_folder):
-                csv_file = os.path.join(parent_folder, csv_file_path)
-                filelist.append(csv_file)
-    return filelist
+def _folder_date(name):
+    try:
+        return datetime.datetime.strptime(name, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def iter_csv_files(filepath, extensions=('.csv',), pattern=None, since=None, until=None, sort=False):
+    """
+    This function lazily walks the dated snapshot folders of a path and yields the
+    files in them.
+    The inout are as follows:
+        filepath - Full qualified path of the folder of %Y-%m-%d snapshot folders
+        extensions - The file extensions to yield, case insensitive
+        pattern - Optional fnmatch pattern of the file names to yield
+        since - Optional datetime.date, the folders dated before it are skipped
+        until - Optional datetime.date, the folders dated after it are skipped
+        sort - Optional flag to yield the folders in date order and the files in name order
+    When since or until is given the folders which are not named as dates are skipped
+    without being listed.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+
+    with os.scandir(filepath) as entries:
+        folders = [entry for entry in entries if entry.is_dir()]
 
+    if since is not None or until is not None:
+        dated = []
+        for folder in folders:
+            folder_date = _folder_date(folder.name)
+            if folder_date is None:
+                continue
+            if since is not None and folder_date < since:
+                continue
+            if until is not None and folder_date > until:
+                continue
+            dated.append(folder)
+        folders = dated
 
+    if sort:
+        folders.sort(key=lambda entry: entry.name)
 
+    for folder in folders:
+        with os.scandir(folder.path) as entries:
+            files = [entry for entry in entries
+                if entry.name.lower().endswith(extensions) and entry.is_file()
+                and (pattern is None or fnmatch.fnmatch(entry.name, pattern))]
+        if sort:
+            files.sort(key=lambda entry: entry.name)
+        for entry in files:
+            yield entry.path
 
+def list_csv_files(filepath):
+    """
+    This function returns the list of CSV files in the snapshot folders of a path.
+    """
+    return list(iter_csv_files(filepath))
@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from . import instrument
+
+
+def read_file(filename):
+    """
+    This function reads the whole content of a file as bytes.
+    """
+    with open(filename, 'rb') as datafile:
+        return datafile.read()
+
+
+async def _read(executor, semaphore, queue, index, filename):
+    """
+    This function reads a file in the I/O executor and puts it on the queue. The
+    semaphore is released only once the queue has taken the content, so that a full
+    queue stops further reads.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        data = await loop.run_in_executor(executor, read_file, filename)
+        await queue.put((index, filename, data))
+    finally:
+        semaphore.release()
+
+
+async def _produce(filelist, queue, io_limit, executor, consumers):
+    semaphore = asyncio.Semaphore(io_limit)
+    pending = set()
+    try:
+        for index, filename in enumerate(filelist):
+            await semaphore.acquire()
+            task = asyncio.ensure_future(_read(executor, semaphore, queue, index, filename))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        while len(pending) > 0:
+            await asyncio.gather(*pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    for _ in range(consumers):
+        await queue.put(None)
+
+
+async def _consume(queue, process, executor, results):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        index, filename, data = item
+        if executor is None:
+            results[index] = process(filename, data)
+        else:
+            results[index] = await loop.run_in_executor(executor, process, filename, data)
+
+
+async def ingest(filelist, process, io_limit=16, workers=1, threads=False, queue_size=None, io_executor=None):
+    """
+    This function reads files concurrently and processes their content while the
+    rest of the files are read. It returns the results in the order of the list.
+    The inout are as follows:
+        filelist - A list of files
+        process - A function of the filename and the bytes of the file, which must
+        be picklable when run in worker processes
+        io_limit - The maximum number of files being read or waiting for the queue
+        workers - The number of compute workers taking the files from the queue,
+        one runs the function in the event loop
+        threads - Optional flag to use threads instead of processes for the workers
+        queue_size - The maximum number of files read but not yet processed, twice
+        the workers by default
+        io_executor - Optional executor of the reads, a pool of io_limit threads
+        by default
+    The files are read in a fixed pool of threads, at most io_limit at a time, and
+    handed to the workers through a bounded queue. When the workers fall behind the
+    queue fills up and no further files are read until it drains.
+    """
+    filelist = list(filelist)
+    if workers is None or workers < 1:
+        workers = 1
+    if queue_size is None:
+        queue_size = 2 * workers
+
+    results = [None] * len(filelist)
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    with instrument.stage('ingest', len(filelist)):
+        own_io_executor = io_executor is None
+        if own_io_executor:
+            io_executor = ThreadPoolExecutor(max_workers=io_limit)
+        executor = None
+        if workers > 1:
+            executor = (ThreadPoolExecutor if threads else ProcessPoolExecutor)(max_workers=workers)
+
+        tasks = [asyncio.ensure_future(_produce(filelist, queue, io_limit, io_executor, workers))]
+        tasks.extend(asyncio.ensure_future(_consume(queue, process, executor, results)) for _ in range(workers))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            if own_io_executor:
+                io_executor.shutdown(wait=True, cancel_futures=True)
+
+    return results
+
+
+def ingest_files(filelist, process, io_limit=16, workers=1, threads=False, queue_size=None):
+    """
+    This function runs ingest in a new event loop for the callers which are not
+    running one.
+    """
+    return asyncio.run(ingest(filelist, process, io_limit, workers, threads, queue_size))
@@ -0,0 +1,144 @@
+import time
+import tracemalloc
+
+_stats = None
+_hooks = []
+
+
+class Stats:
+    """
+    Statistics of the calculation stages. The stages dict has a dict of calls,
+    seconds, items and allocated bytes for each stage name, and the xirr dict has
+    the solves, newton iterations, converged, fallback and failed counts of the
+    XIRR solver.
+    """
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.stages = {}
+        self.xirr = {'solves': 0, 'iterations': 0, 'converged': 0, 'fallbacks': 0, 'failed': 0}
+
+    def record(self, stage, seconds, items, allocated):
+        try:
+            stage_stats = self.stages[stage]
+        except KeyError:
+            stage_stats = {'calls': 0, 'seconds': 0.0, 'items': 0, 'allocated': 0}
+            self.stages[stage] = stage_stats
+        stage_stats['calls'] += 1
+        stage_stats['seconds'] += seconds
+        stage_stats['items'] += items
+        stage_stats['allocated'] += allocated
+
+    def as_dict(self):
+        return {'stages': {stage: dict(values) for stage, values in self.stages.items()}, 'xirr': dict(self.xirr)}
+
+
+class _Stage:
+
+    __slots__ = ('name', 'items', 'begin', 'memory')
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def count(self, items):
+        self.items = items
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.begin
+        allocated = tracemalloc.get_traced_memory()[0] - self.memory if tracemalloc.is_tracing() else 0
+        if _stats is not None:
+            _stats.record(self.name, seconds, self.items, allocated)
+        for hook in _hooks:
+            hook({'stage': self.name, 'seconds': seconds, 'items': self.items, 'allocated': allocated})
+        return False
+
+
+class _NullStage:
+
+    __slots__ = ()
+
+    def count(self, items):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+def enable(stats=None, allocations=False):
+    """
+    This function starts collecting the statistics of the calculation stages and
+    returns the Stats object they are collected in. With allocations the net bytes
+    allocated by each stage are traced with tracemalloc, which slows the run down.
+    """
+    global _stats
+    if stats is None:
+        stats = Stats(allocations)
+    if stats.allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _stats = stats
+    return stats
+
+
+def disable():
+    """
+    This function stops collecting the statistics and returns the Stats object
+    they were collected in.
+    """
+    global _stats
+    stats = _stats
+    _stats = None
+    if stats is not None and stats.allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return stats
+
+
+def add_hook(hook):
+    """
+    This function adds a callback which is called with a dict of stage, seconds,
+    items and allocated at the end of every stage, and with a dict of solver,
+    iterations, converged and fallback after every XIRR solve.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def stage(name, items=0):
+    """
+    This function returns a context manager timing a calculation stage. When the
+    instrumentation is disabled it returns a shared no-op context manager.
+    """
+    if _stats is None and len(_hooks) == 0:
+        return _null_stage
+    return _Stage(name, items)
+
+
+def solver(name, iterations, converged, fallback, solves=1):
+    """
+    This function records the iterations and the convergence of XIRR solves.
+    """
+    if _stats is None and len(_hooks) == 0:
+        return
+    if _stats is not None:
+        xirr = _stats.xirr
+        xirr['solves'] += solves
+        xirr['iterations'] += iterations
+        xirr['converged'] += converged
+        xirr['fallbacks'] += fallback
+        xirr['failed'] += solves - converged
+    for hook in _hooks:
+        hook({'solver': name, 'solves': solves, 'iterations': iterations, 'converged': converged, 'fallback': fallback})
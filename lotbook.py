@@ -0,0 +1,163 @@
+from datetime import date
+import pickle
+import numpy as np
+from .lotmatch import LotMatcher, get_policy
+from .columnar import Records, Lots, Cashflow, BUY, SELL, intern_stocks
+from .calculator import _stock_pnl
+
+
+class LotBook:
+    """
+    Persistent lot state of an account. New trades are applied with apply and
+    update the open lots, the realized lots and P&L and the cashflow in place, so
+    the cost of an update grows with the new trades and not with the history.
+    The book can be checkpointed with save and restored with load.
+    """
+
+    def __init__(self, policy='fifo'):
+        self.policy = get_policy(policy)
+        self.stocks = []
+        self.matchers = {}
+        self.realized = []
+        self.realized_pnl = {}
+        self.flows = {}
+        self.last_date = None
+
+    def apply(self, records):
+        """
+        This function applies new transaction records to the book.
+        The inout are as follows:
+            records - A list of record dicts or columnar.Records. The records
+            must not be older than the records already applied.
+        """
+        if isinstance(records, Records):
+            ids = intern_stocks(records.stocks, self.stocks)[0]
+            data = records.data.copy()
+            data['stock'] = ids[data['stock']]
+        else:
+            data = Records.from_dicts(records, self.stocks).data
+
+        if len(data) == 0:
+            return self
+
+        data = data[np.lexsort((-data['action'], data['date']))]
+        first_date = int(data['date'][0])
+        if self.last_date is not None and first_date < self.last_date:
+            raise ValueError('Records dated %s are older than the last applied date %s'
+                % (date.fromordinal(first_date), date.fromordinal(self.last_date)))
+
+        matchers = self.matchers
+        flows = self.flows
+        realized = self.realized
+        realized_pnl = self.realized_pnl
+
+        for day, action, stock, quantity, price in data.tolist():
+            try:
+                matcher = matchers[stock]
+            except KeyError:
+                matcher = LotMatcher(self.policy)
+                matchers[stock] = matcher
+
+            if action == BUY:
+                matcher.buy(day, quantity, price)
+                amount = -1 * quantity * price
+            elif action == SELL:
+                for buy_date, buy_price, lot_quantity in matcher.sell(quantity):
+                    realized.append((stock, buy_date, buy_price, day, price, True, lot_quantity))
+                    try:
+                        stock_pnl = realized_pnl[stock]
+                    except KeyError:
+                        stock_pnl = [0.0, 0.0]
+                        realized_pnl[stock] = stock_pnl
+                    stock_pnl[0] += lot_quantity * (price - buy_price)
+                    stock_pnl[1] += lot_quantity * buy_price
+                amount = quantity * price
+            else:
+                continue
+
+            flows[day] = flows.get(day, 0.0) + amount
+
+        self.last_date = int(data['date'][-1])
+        return self
+
+    def transactions(self, prices, today=None):
+        """
+        This function returns the realized and open lots of the book as columnar.Lots
+        with the open lots valued at the prices as of today.
+        """
+        today = (today or date.today()).toordinal()
+        trans = list(self.realized)
+        for stock, matcher in self.matchers.items():
+            try:
+                price = prices[self.stocks[stock]]
+            except KeyError:
+                price = 0.0
+            for buy_date, buy_price, lot_quantity in matcher.open_lots():
+                trans.append((stock, buy_date, buy_price, today, price, False, lot_quantity))
+        return Lots.from_rows(trans, self.stocks)
+
+    def pnl(self, prices):
+        """
+        This function returns the P&L of the book in the same format as calculator.pnl.
+        The realized P&L is kept up to date by apply, so only the open lots are valued.
+        The stocks without realized or open lots are left out like in calculator.pnl.
+        """
+        pnl = {}
+        total = [0.0, 0.0, 0.0, 0.0]
+        for stock, matcher in self.matchers.items():
+            open_lots = matcher.open_lots()
+            if stock not in self.realized_pnl and len(open_lots) == 0:
+                continue
+            name = self.stocks[stock]
+            try:
+                price = prices[name]
+            except KeyError:
+                price = 0.0
+            realized, realized_investment = self.realized_pnl.get(stock, (0.0, 0.0))
+            unrealized = 0.0
+            unrealized_investment = 0.0
+            for _, buy_price, lot_quantity in open_lots:
+                unrealized += lot_quantity * (price - buy_price)
+                unrealized_investment += lot_quantity * buy_price
+            values = (realized, unrealized, realized_investment, unrealized_investment)
+            pnl[name] = _stock_pnl(*values)
+            total = [accumulated + value for accumulated, value in zip(total, values)]
+
+        if len(pnl) > 0:
+            pnl['TOTAL'] = _stock_pnl(*total)
+        return pnl
+
+    def cashflow(self, prices, today=None):
+        """
+        This function returns the cashflow of the book as columnar.Cashflow with the
+        value of the open quantity at the prices as of today, 0.0 for the stocks
+        without a price.
+        """
+        today = (today or date.today()).toordinal()
+        flows = dict(self.flows)
+        value = 0.0
+        for stock, matcher in self.matchers.items():
+            if matcher.quantity > 0:
+                value += matcher.quantity * prices.get(self.stocks[stock], 0.0)
+        flows[today] = flows.get(today, 0.0) + value
+
+        days = sorted(flows)
+        return Cashflow(np.array(days, dtype=np.int64), np.array([flows[day] for day in days]))
+
+    def save(self, filepath):
+        """
+        This function checkpoints the book to a file.
+        """
+        with open(filepath, 'wb') as bookfile:
+            pickle.dump(self, bookfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        This function loads a book checkpointed with save.
+        """
+        with open(filepath, 'rb') as bookfile:
+            book = pickle.load(bookfile)
+        if not isinstance(book, cls):
+            raise ValueError('%s is not a lot book checkpoint' % filepath)
+        return book
@@ -0,0 +1,151 @@
+import numpy as np
+from .columnar import Lots
+from .pricestore import _keys
+
+
+class _LotTable:
+    """
+    Lots sorted by stock id and one of their date columns, with the prefix sums of
+    the quantity, cost and profit in that order. The same lots are also kept sorted
+    by the date alone for the queries over all the stocks.
+    """
+
+    __slots__ = ('column', 'data', 'keys', 'sums', 'dated', 'dates', 'dated_sums')
+
+    def __init__(self, data, column):
+        self.column = column
+        self.data = data[np.lexsort((data[column], data['stock']))]
+        self.keys = _keys(self.data['stock'], self.data[column])
+        self.sums = _prefix_sums(self.data)
+        self.dated = data[np.argsort(data[column], kind='stable')]
+        self.dates = self.dated[column]
+        self.dated_sums = _prefix_sums(self.dated)
+
+    def bounds(self, ids, starts, ends):
+        """
+        This function returns the start and end rows of the lots of the stock ids
+        whose date is on or after starts and before ends, -1 ids for all stocks.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        first = np.where(ids >= 0, np.searchsorted(self.keys, _keys(np.maximum(ids, 0), starts)),
+            np.searchsorted(self.dates, starts))
+        last = np.where(ids >= 0, np.searchsorted(self.keys, _keys(np.maximum(ids, 0), ends)),
+            np.searchsorted(self.dates, ends))
+        return first, np.maximum(first, last)
+
+    def totals(self, ids, starts, ends):
+        """
+        This function returns the arrays of the count, quantity, cost and profit of
+        the lots in the ranges of bounds.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        first, last = self.bounds(ids, starts, ends)
+        sums = np.where((ids >= 0)[:, None], self.sums[last] - self.sums[first],
+            self.dated_sums[last] - self.dated_sums[first])
+        return last - first, sums[:, 0], sums[:, 1], sums[:, 2]
+
+
+def _prefix_sums(data):
+    sums = np.zeros((len(data) + 1, 3))
+    np.cumsum(data['quantity'], out=sums[1:, 0])
+    np.cumsum(data['buy_price'] * data['quantity'], out=sums[1:, 1])
+    np.cumsum((data['sell_price'] - data['buy_price']) * data['quantity'], out=sums[1:, 2])
+    return sums
+
+
+class LotIndex:
+    """
+    Range queries over matched lots by stock and date. The open lots are indexed by
+    stock id and buy date and the realized lots by stock id and sell date, so that
+    the lots of a stock in a date range are a binary search away and their quantity,
+    cost and profit are differences of prefix sums. The dates of the queries are
+    datetime.date and the ranges include the start and exclude the end date, either
+    of which may be None for an open ended range.
+    """
+
+    __slots__ = ('stocks', 'ids', 'open', 'realized')
+
+    def __init__(self, lots):
+        """
+        The lots are the columnar.Lots, or the list of dicts, of calculator.transactions
+        or cagr. The profit of the open lots is the unrealized profit at the prices
+        they were matched with.
+        """
+        if not isinstance(lots, Lots):
+            lots = Lots.from_dicts(lots)
+        self.stocks = lots.stocks
+        self.ids = {stock: i for i, stock in enumerate(lots.stocks)}
+        data = lots.data
+        self.open = _LotTable(data[~data['realized']], 'buy_date')
+        self.realized = _LotTable(data[data['realized']], 'sell_date')
+
+    def __len__(self):
+        return len(self.open.data) + len(self.realized.data)
+
+    def _query(self, stocks, starts, ends):
+        """
+        This function converts the stock names and dates of queries into the arrays of
+        stock ids and day ordinals of the tables. Unknown stocks get an id with no lots.
+        """
+        missing = len(self.stocks)
+        ids = [-1 if stock is None else self.ids.get(stock, missing) for stock in stocks]
+        starts = [0 if start is None else start.toordinal() for start in starts]
+        ends = [np.iinfo(np.int32).max if end is None else end.toordinal() for end in ends]
+        return ids, starts, ends
+
+    def _lots(self, table, stock, start, end):
+        ids, starts, ends = self._query([stock], [start], [end])
+        first, last = table.bounds(ids, starts, ends)
+        rows = slice(int(first[0]), int(last[0]))
+        return table.data[rows] if ids[0] >= 0 else table.dated[rows]
+
+    def _totals(self, table, stocks, starts, ends):
+        count, quantity, cost, profit = table.totals(*self._query(stocks, starts, ends))
+        return {'count': count, 'quantity': quantity, 'cost': cost, 'profit': profit}
+
+    def open_lots(self, stock=None, start=None, end=None):
+        """
+        This function returns a view of the lot_dtype array of the open lots of a stock,
+        or of all the stocks, bought in the date range, sorted by buy date.
+        """
+        return self._lots(self.open, stock, start, end)
+
+    def realized_lots(self, stock=None, start=None, end=None):
+        """
+        This function returns a view of the lot_dtype array of the realized lots of a
+        stock, or of all the stocks, sold in the date range, sorted by sell date.
+        """
+        return self._lots(self.realized, stock, start, end)
+
+    def open_totals(self, stock=None, start=None, end=None):
+        """
+        This function returns a dict of the count, quantity, cost and unrealized profit
+        of the open lots of open_lots.
+        """
+        totals = self._totals(self.open, [stock], [start], [end])
+        return {key: values[0].item() for key, values in totals.items()}
+
+    def realized_totals(self, stock=None, start=None, end=None):
+        """
+        This function returns a dict of the count, quantity, cost and realized profit
+        of the realized lots of realized_lots.
+        """
+        totals = self._totals(self.realized, [stock], [start], [end])
+        return {key: values[0].item() for key, values in totals.items()}
+
+    def open_totals_batch(self, stocks, starts, ends):
+        """
+        This function answers many open_totals queries together. The stocks, starts and
+        ends are lists of equal length, and it returns a dict of arrays of the count,
+        quantity, cost and profit with one value per query.
+        """
+        return self._totals(self.open, stocks, starts, ends)
+
+    def realized_totals_batch(self, stocks, starts, ends):
+        """
+        This function answers many realized_totals queries together like
+        open_totals_batch.
+        """
+        return self._totals(self.realized, stocks, starts, ends)
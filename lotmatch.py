@@ -0,0 +1,134 @@
+from collections import deque
+
+# Quantities within the tolerance of zero are taken as zero, so that the rounding
+# of fractional fills does not leave lots of a few 1e-17 shares.
+quantity_tolerance = 1e-9
+
+
+class FifoPolicy:
+    """
+    Matches a sale against the oldest open lot first.
+    """
+
+    name = 'fifo'
+
+    @staticmethod
+    def head(lots):
+        return lots[0]
+
+    @staticmethod
+    def remove(lots):
+        lots.popleft()
+
+    @staticmethod
+    def buy_price(lot, matcher):
+        return lot[1]
+
+
+class LifoPolicy(FifoPolicy):
+    """
+    Matches a sale against the latest open lot first.
+    """
+
+    name = 'lifo'
+
+    @staticmethod
+    def head(lots):
+        return lots[-1]
+
+    @staticmethod
+    def remove(lots):
+        lots.pop()
+
+
+class AverageCostPolicy(FifoPolicy):
+    """
+    Matches a sale against the oldest open lot first, but the buy price of
+    every matched and open lot is the average cost of the open quantity.
+    """
+
+    name = 'average'
+
+    @staticmethod
+    def buy_price(lot, matcher):
+        return matcher.cost / matcher.quantity
+
+
+policies = {policy.name: policy for policy in (FifoPolicy, LifoPolicy, AverageCostPolicy)}
+
+
+def get_policy(policy):
+    """
+    This function returns the policy class for a policy name, a policy class is
+    returned as it is.
+    """
+    if isinstance(policy, str):
+        try:
+            return policies[policy.lower()]
+        except KeyError:
+            raise ValueError('Unknown lot matching policy %s, expected one of %s' % (policy, ', '.join(policies)))
+    return policy
+
+
+class LotMatcher:
+    """
+    Matches the trades of a single stock against a deque of open lots. The trades
+    are fed in date order and every trade is handled in constant time apart from
+    the lots it closes. Each open lot is a list of buy date, buy price and the
+    remaining quantity.
+    """
+
+    __slots__ = ('policy', 'lots', 'quantity', 'cost')
+
+    def __init__(self, policy='fifo'):
+        self.policy = get_policy(policy)
+        self.lots = deque()
+        self.quantity = 0.0
+        self.cost = 0.0
+
+    def buy(self, day, quantity, price):
+        """
+        This function adds a bought lot to the open lots.
+        """
+        self.lots.append([day, price, quantity])
+        self.quantity += quantity
+        self.cost += quantity * price
+
+    def sell(self, quantity):
+        """
+        This function closes the open lots for a sale as per the policy and returns
+        the list of matched buy date, buy price and quantity. The quantity sold in
+        excess of the open quantity is not matched.
+        """
+        policy = self.policy
+        lots = self.lots
+        matched = []
+
+        while quantity > quantity_tolerance and len(lots) > 0:
+            lot = policy.head(lots)
+            buy_price = policy.buy_price(lot, self)
+            lot_quantity = min(lot[2], quantity)
+            if lot[2] - lot_quantity <= quantity_tolerance:
+                lot_quantity = lot[2]
+            matched.append((lot[0], buy_price, lot_quantity))
+
+            quantity -= lot_quantity
+            lot[2] -= lot_quantity
+            self.quantity -= lot_quantity
+            self.cost -= lot_quantity * buy_price
+            if lot[2] <= quantity_tolerance:
+                lot[2] = 0.0
+                policy.remove(lots)
+
+        if len(lots) == 0:
+            self.quantity = 0.0
+            self.cost = 0.0
+
+        return matched
+
+    def open_lots(self):
+        """
+        This function returns the list of open buy date, buy price and quantity.
+        """
+        policy = self.policy
+        return [(lot[0], policy.buy_price(lot, self), lot[2]) for lot in self.lots]
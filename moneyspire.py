@@ -1,37 +1,79 @@
 import csv
 import datetime
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from . import instrument
 
 def read_records_file(filepath):
-    with open(filepath) as csvfile:
-        preader = csv.DictReader(csvfile)
+    with instrument.stage('moneyspire_read_records_file') as stage, open(filepath, newline='') as csvfile:
+        preader = csv.reader(csvfile)
+        try:
+            header = next(preader)
+        except StopIteration:
+            return []
+        if "Date" not in header or "Action" not in header or "Investment" not in header:
+            # Not a Moneyspire export, none of its rows has an investment.
+            return []
+        date_index = header.index("Date")
+        action_index = header.index("Action")
+        investment_index = header.index("Investment")
+        width = max(date_index, action_index, investment_index)
+
         records = []
         for row in preader:
-            if row.get("Investment"):
-                clean_record = parse_record(row)
+            if len(row) > width and row[investment_index]:
+                clean_record = _parse_row(row[date_index], row[action_index], row[investment_index])
                 if clean_record is not None:
                     records.append(clean_record)
 
+        stage.count(len(records))
         return records
 
+def read_records_dir(dirpath, workers=None):
+    """
+    This function reads all the Moneyspire exports in a folder across a process pool
+    and returns one stream of the records of all the files sorted by date.
+    The inout are as follows:
+        dirpath - Full qualified path of the folder of exports
+        workers - Optional number of worker processes, 1 reads the files serially
+    """
+    filelist = sorted(os.path.join(dirpath, filename) for filename in os.listdir(dirpath)
+        if filename.lower().endswith('.csv'))
+
+    if workers == 1 or len(filelist) <= 1:
+        file_records = [read_records_file(filepath) for filepath in filelist]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            file_records = list(executor.map(read_records_file, filelist))
+
+    for records in file_records:
+        records.sort(key=_record_date)
+    return heapq.merge(*file_records, key=_record_date)
+
+def _record_date(record):
+    return record["date"]
+
+@lru_cache(maxsize=65536)
+def _parse_date(date_str):
+    return datetime.datetime.strptime(date_str, '%d/%m/%Y').date()
+
 def parse_record(record):
-    clean_record = {}
-    date_str = record["Date"]
-    date_obj = datetime.datetime.strptime(date_str, '%d/%m/%Y')
-    clean_record["date"] = date_obj.date()
+    return _parse_row(record["Date"], record["Action"], record["Investment"])
 
-    clean_record["action"] = record["Action"]
+def _parse_row(date_str, action, investment):
+    clean_record = {}
+    clean_record["date"] = _parse_date(date_str)
 
-    investment = record["Investment"]
-    stock = investment.split(':')[0].strip()
-    clean_record["stock"] = stock
+    clean_record["action"] = action
 
-    quantity_str = investment.split(':')[1].split("@")[0].strip()
-    quantity = float(quantity_str)
-    clean_record["quantity"] = quantity
+    investment = investment.split(':')
+    clean_record["stock"] = investment[0].strip()
 
-    price_str = investment.split(':')[1].split("@")[1].strip()
-    price = float(price_str)
-    clean_record["price"] = price
+    trade = investment[1].split("@")
+    clean_record["quantity"] = float(trade[0].strip())
+    clean_record["price"] = float(trade[1].strip())
 
     return clean_record
 
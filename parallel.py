@@ -0,0 +1,124 @@
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import shared_memory
+import numpy as np
+from . import instrument
+from .calculator import _transactions, _cagr_transactions, _pnl_aggregates, _pnl_dict
+from .columnar import Records, Lots, record_dtype, lot_dtype, lot_columns, cagr_columns
+from .lotmatch import get_policy
+
+
+def shard_stocks(counts, shards):
+    """
+    This function balances the stocks across shards by their record counts. The
+    stocks are taken from the largest count down and each is put on the shard with
+    the fewest records so far. It returns a list of sorted arrays of stock ids, one
+    per shard, leaving out the stocks without records.
+    """
+    counts = np.asarray(counts)
+    loads = [(0, shard) for shard in range(max(1, shards))]
+    members = [[] for _ in loads]
+    for stock in np.argsort(-counts, kind='stable').tolist():
+        if counts[stock] == 0:
+            break
+        load, shard = heapq.heappop(loads)
+        members[shard].append(stock)
+        heapq.heappush(loads, (load + int(counts[stock]), shard))
+    return [np.array(sorted(stocks), dtype=np.int64) for stocks in members]
+
+
+def _match_rows(data, ranges, prices, count, policy, today):
+    """
+    This function matches the records of the stocks of a shard, calculates the CAGR
+    of the lots and aggregates their P&L. The data is sorted by stock, date and
+    action, and ranges has the start and end rows of each stock of the shard.
+    """
+    trans = []
+    for (start, end), price in zip(ranges, prices):
+        trans.extend(_transactions(data[start:end], price, today, policy))
+    lots = _cagr_transactions(Lots.from_rows(trans, None)).data
+    aggregates = _pnl_aggregates(lots['stock'], count, lots['realized'], lots['profit'],
+        lots['buy_price'] * lots['quantity'])
+    return lots, aggregates
+
+
+def _match_shard(name, length, ranges, prices, count, policy, today):
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        data = np.ndarray((length,), dtype=record_dtype, buffer=block.buf)
+        try:
+            return _match_rows(data, ranges, prices, count, policy, today)
+        finally:
+            del data
+    finally:
+        block.close()
+
+
+def transactions_pnl(records, prices, policy='fifo', workers=None):
+    """
+    This function matches the transactions, calculates their CAGR and the P&L like
+    cagr(transactions(records, prices, policy)) and pnl of them, with the stocks
+    sharded across a pool of worker processes.
+    The inout are as follows:
+        records - A list of record dicts or columnar.Records
+        prices - A dict of the current prices of stocks
+        policy - The lot matching policy of calculator.transactions
+        workers - The number of worker processes, one per CPU by default
+    The records are sorted once and put in a shared memory block which the workers
+    read their stocks from, so only the row ranges and prices of the shards are
+    pickled. The shards are balanced by record count. Each worker returns its lots
+    and P&L aggregates, which are merged into the lots in stock order and the P&L
+    with the TOTAL of all the shards. It returns the lots and the P&L dict, the lots
+    as dicts when the records are dicts.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    policy = get_policy(policy)
+    columnar = records if isinstance(records, Records) else Records.from_dicts(records)
+
+    with instrument.stage('transactions_pnl', len(columnar)):
+        stocks = columnar.stocks
+        data = columnar.data
+        data = data[np.lexsort((-data['action'], data['date'], data['stock']))]
+        counts = np.bincount(data['stock'], minlength=len(stocks))
+        bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+        stock_prices = [prices.get(stock, 0.0) for stock in stocks]
+        today = date.today().toordinal()
+
+        jobs = []
+        for shard in shard_stocks(counts, workers):
+            if len(shard) > 0:
+                shard = shard.tolist()
+                jobs.append(([(bounds[i], bounds[i + 1]) for i in shard], [stock_prices[i] for i in shard]))
+
+        if len(jobs) <= 1:
+            results = [_match_rows(data, ranges, shard_prices, len(stocks), policy, today)
+                for ranges, shard_prices in jobs]
+        else:
+            block = shared_memory.SharedMemory(create=True, size=data.nbytes)
+            try:
+                shared = np.ndarray(data.shape, dtype=record_dtype, buffer=block.buf)
+                shared[:] = data
+                del shared
+                with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                    futures = [executor.submit(_match_shard, block.name, len(data), ranges, shard_prices,
+                        len(stocks), policy, today) for ranges, shard_prices in jobs]
+                    results = [future.result() for future in futures]
+            finally:
+                block.close()
+                block.unlink()
+
+        if len(results) == 0:
+            lots = Lots(np.empty(0, dtype=lot_dtype), stocks, lot_columns + cagr_columns)
+            pnl = {}
+        else:
+            lots = np.concatenate([shard_lots for shard_lots, _ in results])
+            lots = Lots(lots[np.argsort(lots['stock'], kind='stable')], stocks, lot_columns + cagr_columns)
+            profits, investments, lot_counts = (sum(columns) for columns in zip(*(aggregates for _, aggregates in results)))
+            pnl = _pnl_dict(stocks, profits, investments, lot_counts)
+
+    if columnar is records:
+        return lots, pnl
+    return lots.to_dicts(), pnl
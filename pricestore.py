@@ -0,0 +1,106 @@
+import numpy as np
+from .columnar import Lots, intern_stocks, cagr_columns
+
+price_history_dtype = np.dtype([
+    ('stock', np.int32),
+    ('date', np.int64),
+    ('price', np.float64)])
+
+
+class PriceStore:
+    """
+    Historical prices of stocks. The prices are kept in arrays sorted by stock id
+    and date, with the dates as day ordinals and the stocks as ids into the stocks
+    list, so that the price of any stock as of any date is a binary search.
+    """
+
+    __slots__ = ('stocks', 'ids', 'dates', 'prices', 'keys')
+
+    def __init__(self, stocks, ids, dates, prices):
+        order = np.lexsort((dates, ids))
+        self.stocks = stocks
+        self.ids = np.asarray(ids, dtype=np.int32)[order]
+        self.dates = np.asarray(dates, dtype=np.int64)[order]
+        self.prices = np.asarray(prices, dtype=np.float64)[order]
+        self.keys = _keys(self.ids, self.dates)
+
+    def __len__(self):
+        return len(self.prices)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        This function builds the store from an iterable of stock, datetime.date and price.
+        """
+        rows = list(rows)
+        if len(rows) == 0:
+            return cls([], [], [], [])
+        names, dates, prices = zip(*rows)
+        ids, stocks = intern_stocks(names)
+        return cls(stocks, ids, [day.toordinal() for day in dates], prices)
+
+    def stock_ids(self, names):
+        """
+        This function returns the array of ids of stock names, -1 for the stocks
+        which are not in the store.
+        """
+        index = {stock: i for i, stock in enumerate(self.stocks)}
+        return np.array([index.get(name, -1) for name in names], dtype=np.int32)
+
+    def asof(self, ids, dates):
+        """
+        This function returns the latest prices on or before the dates for arrays of
+        stock ids and day ordinals, nan where there is no such price.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        dates = np.asarray(dates, dtype=np.int64)
+        if len(self.prices) == 0:
+            return np.full(len(ids), np.nan)
+
+        index = np.searchsorted(self.keys, _keys(ids, dates), side='right') - 1
+        index = np.maximum(index, 0)
+        found = (ids >= 0) & (self.ids[index] == ids) & (self.dates[index] <= dates)
+        return np.where(found, self.prices[index], np.nan)
+
+    def price(self, stock, day):
+        """
+        This function returns the latest price of a stock on or before a datetime.date,
+        None when there is no such price.
+        """
+        price = self.asof(self.stock_ids([stock]), [day.toordinal()])[0]
+        return None if np.isnan(price) else float(price)
+
+    def prices_on(self, day):
+        """
+        This function returns a dict of the latest price of each stock on or before a
+        datetime.date, in the format taken by calculator.transactions and cashflow.
+        """
+        ids = np.arange(len(self.stocks))
+        prices = self.asof(ids, np.full(len(ids), day.toordinal()))
+        return {self.stocks[i]: price for i, price in zip(ids.tolist(), prices.tolist()) if not np.isnan(price)}
+
+    def value_lots(self, lots, day):
+        """
+        This function returns the lots held on a datetime.date valued as of that date.
+        The input are columnar.Lots matched over any history. The lots bought after the
+        date are dropped, and the lots which were still open on the date are unrealized
+        with the latest price on or before the date as the sell price. The lots of the
+        average cost policy keep the average cost at the time of their sale.
+        """
+        ordinal = day.toordinal()
+        data = lots.data[lots.data['buy_date'] <= ordinal].copy()
+        held = ~data['realized'] | (data['sell_date'] > ordinal)
+
+        ids = self.stock_ids(lots.stocks)[data['stock'][held]]
+        prices = self.asof(ids, np.full(len(ids), ordinal))
+        data['sell_price'][held] = np.where(np.isnan(prices), 0.0, prices)
+        data['sell_date'][held] = ordinal
+        data['realized'][held] = False
+        for column in cagr_columns:
+            data[column] = np.nan
+
+        return Lots(data, lots.stocks)
+
+
+def _keys(ids, dates):
+    return (np.asarray(ids, dtype=np.int64) << 32) + np.asarray(dates, dtype=np.int64)
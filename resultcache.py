@@ -0,0 +1,183 @@
+import hashlib
+import sys
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from . import calculator
+from .columnar import Records, Lots, Cashflow
+
+
+def fingerprint_records(records):
+    """
+    This function returns a blake2b digest of the columnar data and the stock names
+    of transaction records. A list of record dicts is converted to columnar.Records.
+    """
+    if not isinstance(records, Records):
+        records = Records.from_dicts(records)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(records.data).view(np.uint8))
+    digest.update('\x00'.join(records.stocks).encode('utf-8'))
+    return digest.digest()
+
+
+def fingerprint_prices(prices):
+    """
+    This function returns a blake2b digest of a dict of stock prices, or of None.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if prices is not None:
+        stocks = sorted(prices)
+        digest.update('\x00'.join(stocks).encode('utf-8'))
+        digest.update(np.array([prices[stock] for stock in stocks], dtype=np.float64).view(np.uint8))
+    return digest.digest()
+
+
+def _nbytes(value):
+    """
+    This function estimates the memory held by a cached result.
+    """
+    if isinstance(value, Lots):
+        return value.data.nbytes + sum(sys.getsizeof(stock) for stock in value.stocks)
+    if isinstance(value, Cashflow):
+        return value.dates.nbytes + value.amounts.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(stock) + sys.getsizeof(values) + 32 * len(values)
+            for stock, values in value.items())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    A memoizing front of the calculator functions for records and prices which are
+    calculated again and again. The results are kept in a LRU keyed by a
+    fingerprint of the records, the prices, the arguments and today's date, since
+    the open lots and the cashflow are valued as of today. The least recently used
+    results are evicted once they hold more than maxbytes.
+
+    The cached results are copied on the way out, so the callers may modify them,
+    and the results of record dicts are returned as dicts like the calculator
+    functions do. The records are hashed on every call, so records modified in
+    place get a new fingerprint. Record dicts are converted to columnar.Records on
+    every call as well, so the callers with many lookups should pass the columnar
+    records.
+    """
+
+    __slots__ = ('maxbytes', 'nbytes', 'entries', 'hits', 'misses', 'evictions')
+
+    def __init__(self, maxbytes=64 * 1024 * 1024):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        This function returns a dict of the hits, misses, evictions, entries and bytes
+        of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'entries': len(self.entries), 'bytes': self.nbytes}
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def _get(self, key, compute, errors=()):
+        try:
+            value, nbytes = self.entries[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+        try:
+            value = compute()
+        except errors as error:
+            value = error
+        nbytes = _nbytes(value)
+        if nbytes <= self.maxbytes:
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+        return value
+
+    def _records(self, records):
+        """
+        This function returns the columnar records and their fingerprint.
+        """
+        columnar = _columnar(records)
+        return columnar, fingerprint_records(columnar)
+
+    def _key(self, name, digest, prices, *args):
+        return (name, digest, fingerprint_prices(prices), date.today().toordinal()) + args
+
+    def _lots(self, columnar, digest, prices, policy):
+        key = self._key('transactions', digest, prices, policy)
+        return self._get(key, lambda: calculator.transactions(columnar, prices, policy))
+
+    def _cashflow(self, columnar, digest, prices):
+        key = self._key('cashflow', digest, prices)
+        return self._get(key, lambda: calculator.cashflow(columnar, prices))
+
+    def transactions(self, records, prices, policy='fifo'):
+        """
+        This function returns calculator.transactions of the records and prices.
+        """
+        columnar, digest = self._records(records)
+        lots = self._lots(columnar, digest, prices, policy)
+        lots = Lots(lots.data.copy(), lots.stocks, lots.columns)
+        if columnar is records:
+            return lots
+        return lots.to_dicts()
+
+    def pnl(self, records, prices, policy='fifo'):
+        """
+        This function returns calculator.pnl of the transactions of the records and
+        prices.
+        """
+        columnar, digest = self._records(records)
+
+        def compute():
+            lots = self._lots(columnar, digest, prices, policy)
+            return calculator.pnl(calculator.cagr(Lots(lots.data.copy(), lots.stocks, lots.columns)))
+
+        pnl = self._get(self._key('pnl', digest, prices, policy), compute)
+        return {stock: dict(values) for stock, values in pnl.items()}
+
+    def cashflow(self, records, prices):
+        """
+        This function returns calculator.cashflow of the records and prices.
+        """
+        columnar, digest = self._records(records)
+        flows = self._cashflow(columnar, digest, prices)
+        if columnar is records:
+            return Cashflow(flows.dates.copy(), flows.amounts.copy())
+        return flows.to_dict()
+
+    def xirr(self, records, prices, guess=.10):
+        """
+        This function returns calculator.xirr of the cashflow of the records and prices.
+        The RuntimeError of a cashflow without a solution is cached as well.
+        """
+        columnar, digest = self._records(records)
+        rate = self._get(self._key('xirr', digest, prices, guess),
+            lambda: calculator.xirr(self._cashflow(columnar, digest, prices), guess), RuntimeError)
+        if isinstance(rate, RuntimeError):
+            raise rate
+        return rate
+
+
+def _columnar(records):
+    if isinstance(records, Records):
+        return records
+    return Records.from_dicts(records)
@@ -0,0 +1,137 @@
+from datetime import date
+import numpy as np
+from . import calculator
+from . import instrument
+from .columnar import Records
+
+
+class Scenarios:
+    """
+    The XIRR and the unrealized P&L of a portfolio under many price scenarios. The
+    records are matched into lots and the historical cashflow is built once, since
+    only the value of the open lots and the terminal cashflow of today depend on the
+    prices. Each scenario is a vector of prices over the stocks of the prices dict,
+    and all the scenarios are valued and solved together.
+    """
+
+    __slots__ = ('stocks', 'prices', 'open_quantities', 'costs', 'unpriced_cost', 'held',
+        'realized', 'realized_investment', 'pmts', 'years', 'today')
+
+    def __init__(self, records, prices, policy='fifo', today=None):
+        """
+        The inout are as follows:
+            records - A list of record dicts or columnar.Records
+            prices - A dict of the current prices, the base scenario, whose stocks
+            are the columns of the price matrices
+            policy - The lot matching policy of calculator.transactions
+            today - Optional datetime.date of the valuation, today by default
+        """
+        if not isinstance(records, Records):
+            records = Records.from_dicts(records)
+        if today is None:
+            today = date.today()
+        self.today = today
+        self.stocks = list(prices)
+        self.prices = np.array([prices[stock] for stock in self.stocks], dtype=np.float64)
+
+        # The columns of the record stocks in the price matrices, the stocks
+        # without a price are valued at 0.0 like in calculator.transactions.
+        columns = {stock: i for i, stock in enumerate(self.stocks)}
+        stock_columns = np.array([columns.get(stock, -1) for stock in records.stocks], dtype=np.int64)
+        priced = stock_columns >= 0
+
+        with instrument.stage('scenarios_match', len(records)):
+            lots = calculator.transactions(records, {}, policy).data
+            realized = lots['realized']
+            investment = lots['buy_price'] * lots['quantity']
+            self.realized = float(np.dot(lots['sell_price'][realized] - lots['buy_price'][realized], lots['quantity'][realized]))
+            self.realized_investment = float(investment[realized].sum())
+
+            open_lots = lots[~realized]
+            open_columns = stock_columns[open_lots['stock']]
+            open_priced = open_columns >= 0
+            self.open_quantities = np.bincount(open_columns[open_priced],
+                weights=open_lots['quantity'][open_priced], minlength=len(self.stocks))
+            self.costs = np.bincount(open_columns[open_priced],
+                weights=investment[~realized][open_priced], minlength=len(self.stocks))
+            self.unpriced_cost = float(investment[~realized][~open_priced].sum())
+
+            data = records.data[records.data['action'] != 0]
+            held = np.bincount(data['stock'], weights=data['action'] * data['quantity'], minlength=len(records.stocks))
+            self.held = np.bincount(stock_columns[priced], weights=held[priced], minlength=len(self.stocks))
+
+            flows = calculator.cashflow(records, None)
+            days = np.append(flows.dates, today.toordinal())
+            self.pmts = np.append(flows.amounts, 0.0)
+            self.years = (days - days.min()) / 365.
+
+    def __len__(self):
+        return len(self.stocks)
+
+    def shock(self, shocks):
+        """
+        This function returns the price matrix of relative price moves of the base
+        prices. The shocks are either a 1-D array with one move of all the stocks per
+        scenario or a 2-D array with one row of moves per scenario, 0.1 for +10%.
+        """
+        shocks = np.asarray(shocks, dtype=np.float64)
+        if shocks.ndim == 1:
+            shocks = shocks[:, None]
+        return self.prices[None, :] * (1. + shocks)
+
+    def base_xirr(self, default=.10):
+        """
+        This function returns the XIRR of the base prices, or the default when it
+        cannot be solved.
+        """
+        pmts = self.pmts.copy()
+        pmts[-1] = np.dot(self.prices, self.held)
+        rates, converged = calculator.xirr_batch(pmts[None, :], self.years[None, :], guess=default)
+        return float(rates[0]) if converged[0] else default
+
+    def run(self, price_matrix, guess=None):
+        """
+        This function values the portfolio under each row of the price matrix.
+        The inout are as follows:
+            price_matrix - A 2-D array with one row of prices per scenario and one
+            column per stock of the base prices dict
+            guess - Optional starting rate of the XIRR solves, the XIRR of the base
+            prices by default
+        It returns a dict of arrays with one value per scenario
+            value - The value of the holdings, the terminal cashflow of today
+            unrealized - The unrealized profit of the open lots
+            unrealized_pnl - The unrealized profit on the unrealized investment
+            stock_unrealized - A 2-D array of the unrealized profit of each stock
+            xirr - The XIRR of the cashflow, nan where it could not be solved
+            converged - True where the XIRR was solved
+        and the realized, realized_investment and unrealized_investment which do not
+        depend on the prices.
+        """
+        price_matrix = np.atleast_2d(np.asarray(price_matrix, dtype=np.float64))
+        if price_matrix.shape[1] != len(self.stocks):
+            raise ValueError('The price matrix has %d columns for %d stocks' % (price_matrix.shape[1], len(self.stocks)))
+
+        with instrument.stage('scenarios', len(price_matrix)):
+            unrealized_investment = float(self.costs.sum()) + self.unpriced_cost
+            stock_unrealized = price_matrix * self.open_quantities[None, :] - self.costs[None, :]
+            unrealized = stock_unrealized.sum(axis=1) - self.unpriced_cost
+            value = price_matrix @ self.held
+
+            if guess is None:
+                guess = self.base_xirr()
+            pmts = np.repeat(self.pmts[None, :], len(price_matrix), axis=0)
+            pmts[:, -1] = value
+            years = np.broadcast_to(self.years, pmts.shape)
+            rates, converged = calculator.xirr_batch(pmts, years, guess=guess)
+
+        result = {}
+        result['value'] = value
+        result['unrealized'] = unrealized
+        result['unrealized_pnl'] = unrealized / unrealized_investment if unrealized_investment != 0 else np.zeros(len(value))
+        result['stock_unrealized'] = stock_unrealized
+        result['xirr'] = rates
+        result['converged'] = converged
+        result['realized'] = self.realized
+        result['realized_investment'] = self.realized_investment
+        result['unrealized_investment'] = unrealized_investment
+        return result
@@ -1,38 +1,145 @@
 import csv
 import os
 import datetime
-
-def parse_portfolio_file(filename):
+import functools
+import io
+import json
+import locale
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from . import instrument
+from .ingest import ingest_files
+
+summary_cache_version = 1
+
+def _summary_values(cost_str, value_str):
+    cost = 0.0
+    value = 0.0
+    if cost_str is not None and cost_str != '' and value_str is not None and value_str != '':
+        cost = float(cost_str)
+        value = float(value_str)
+    return cost, value
+
+def _parse_portfolio_tail(filename, blocksize=8192, maxsize=1048576):
+    """
+    This function reads the header and then blocks from the end of a portfolio output
+    file until it finds the last row with an empty Symbol. It returns None when the
+    layout is not the expected one so that the caller can scan the whole file.
+    """
+    with open(filename, 'rb') as csvfile:
+        return _parse_portfolio_stream_tail(csvfile, blocksize, maxsize)
+
+def _parse_portfolio_stream_tail(csvfile, blocksize, maxsize):
+    encoding = locale.getpreferredencoding(False)
+    header_line = csvfile.readline()
+    try:
+        header = next(csv.reader([header_line.decode(encoding)]))
+        symbol_index = header.index('Symbol')
+        cost_index = header.index('Cost basis')
+        value_index = header.index('Total')
+    except (StopIteration, UnicodeDecodeError, ValueError):
+        return None
+
+    header_end = len(header_line)
+    size = csvfile.seek(0, os.SEEK_END)
+
+    while True:
+        start = max(header_end, size - blocksize)
+        csvfile.seek(start)
+        try:
+            lines = csvfile.read(size - start).decode(encoding).splitlines()
+        except UnicodeDecodeError:
+            return None
+        if start > header_end:
+            lines = lines[1:]
+
+        summary = None
+        for row in csv.reader(lines):
+            if len(row) == 0:
+                continue
+            if len(row) != len(header):
+                return None
+            if row[symbol_index] == '':
+                summary = row
+
+        if summary is not None:
+            return _summary_values(summary[cost_index], summary[value_index])
+        if start == header_end:
+            return 0.0, 0.0
+        if blocksize >= maxsize:
+            return None
+        blocksize *= 2
+
+def parse_portfolio_file(filename, fast=False):
     """
     This function will parse a portfolio output file
+    With fast the totals row is looked up from the end of the file, and the whole
+    file is scanned only when the layout is not the expected one.
+    """
+    with instrument.stage('parse_portfolio_file', 1):
+        if fast:
+            summary = _parse_portfolio_tail(filename)
+            if summary is not None:
+                return summary
+        return _scan_portfolio_file(filename)
+
+def parse_portfolio_data(filename, data, fast=False):
     """
+    This function parses the bytes of a portfolio output file, which have already
+    been read, like parse_portfolio_file.
+    """
+    with instrument.stage('parse_portfolio_data', 1):
+        if fast:
+            summary = _parse_portfolio_stream_tail(io.BytesIO(data), 8192, 1048576)
+            if summary is not None:
+                return summary
+        return _scan_portfolio_rows(io.TextIOWrapper(io.BytesIO(data)))
+
+def _scan_portfolio_file(filename):
     with open(filename) as csvfile:
+        return _scan_portfolio_rows(csvfile)
 
-        preader = csv.DictReader(csvfile)
-        cost = 0.0
-        value = 0.0
-        cost_str = None
-        value_str = None
+def _scan_portfolio_rows(csvfile):
 
-        for row in preader:
-            record = {}
-            record['Symbol'] = row.get('Symbol')
-            if row.get('Symbol') is None or row.get('Symbol') is '':
-                cost_str = row.get('Cost basis')
-                value_str = row.get('Total')
+    preader = csv.DictReader(csvfile)
+    cost_str = None
+    value_str = None
 
-        if cost_str is not None and cost_str is not '' and value_str is not None and value_str is not '':
-           cost = float(cost_str)
-           value = float(value_str)
+    for row in preader:
+        if row.get('Symbol') is None or row.get('Symbol') == '':
+            cost_str = row.get('Cost basis')
+            value_str = row.get('Total')
 
-        return cost, value
+    return _summary_values(cost_str, value_str)
 
-def get_portfolio_summary(csvfile):
+def get_portfolio_summary(csvfile, fast=False):
     """
     This function takes a CSV file, parses the file to return a dict of
-    summary values.
+    summary values. The fast flag is passed on to parse_portfolio_file.
     """
     
+    summary = _file_summary(csvfile)
+
+    cost, value = parse_portfolio_file(csvfile, fast)
+    summary["cost"] = cost
+    summary["value"] = value
+
+    return summary
+
+def get_portfolio_data_summary(csvfile, data, fast=False):
+    """
+    This function returns the summary dict of a portfolio file like
+    get_portfolio_summary from the bytes of the file which have already been read.
+    """
+    summary = _file_summary(csvfile)
+
+    cost, value = parse_portfolio_data(csvfile, data, fast)
+    summary["cost"] = cost
+    summary["value"] = value
+
+    return summary
+
+def _file_summary(csvfile):
     summary = {}
     
     filename = os.path.basename(csvfile)
@@ -42,10 +149,6 @@ def get_portfolio_summary(csvfile):
     date = datetime.datetime.strptime(foldername, "%Y-%m-%d").date()
     summary["date"] = date
 
-    cost, value = parse_portfolio_file(csvfile)
-    summary["cost"] = cost
-    summary["value"] = value
-
     return summary
 
 def update_summary_data(summary):
@@ -59,7 +162,6 @@ def update_summary_data(summary):
     summary['gain'] = gain
 
     if cost > 0 or cost < 0:
-        print(gain, cost)
         gain_percent = (gain / cost) * 100
         summary['gain %'] = gain_percent
 
@@ -75,7 +177,102 @@ def is_error_summary(summary):
     
     return True
 
-def map_portfolio_summary(filelist, summary_folder):
+def get_portfolio_summaries(filelist, workers=1, threads=False, fast=False, io_limit=None):
+    """
+    This function returns the summaries of a list of portfolio files in the order
+    of the list. With more than one worker the list is sharded across a process
+    pool, or a thread pool with threads, and the files are parsed concurrently.
+    With io_limit the files are read concurrently, at most io_limit at a time,
+    and parsed by the workers as they arrive, see ingest.ingest.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if io_limit is not None:
+        process = functools.partial(get_portfolio_data_summary, fast=fast)
+        return ingest_files(filelist, process, io_limit, workers, threads)
+
+    if workers > 1:
+        executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        chunksize = max(1, len(filelist) // (workers * 4))
+        with executor_class(max_workers=workers) as executor:
+            return list(executor.map(get_portfolio_summary, filelist, repeat(fast), chunksize=chunksize))
+
+    return [get_portfolio_summary(csvfile, fast) for csvfile in filelist]
+
+def load_summary_cache(cachefile):
+    """
+    This function loads the summary cache of the portfolio files, it returns an
+    empty cache when the file does not exist.
+    """
+    try:
+        with open(cachefile) as jsonfile:
+            cache = json.load(jsonfile)
+    except FileNotFoundError:
+        return {}
+    if cache.get('version') != summary_cache_version:
+        return {}
+    return cache['files']
+
+def save_summary_cache(cache, cachefile):
+    """
+    This function saves the summary cache of the portfolio files. The cache is
+    written to a temporary file first and then moved over the cache file.
+    """
+    tempfile = cachefile + '.tmp'
+    with open(tempfile, 'w') as jsonfile:
+        json.dump({'version': summary_cache_version, 'files': cache}, jsonfile)
+    os.replace(tempfile, cachefile)
+
+def get_cached_summaries(filelist, cache, workers=1, threads=False, fast=False, io_limit=None, update=None):
+    """
+    This function returns the summaries of a list of portfolio files like
+    get_portfolio_summaries, but only the files whose path, modification time or
+    size are not in the cache are parsed. The cache is updated in place and the
+    entries of the files which no longer exist are evicted. With update only the
+    files in it are checked for changes, the other files are taken from the cache
+    as they are and parsed only when they are not in it.
+    """
+    if update is not None:
+        update = set(update)
+    fingerprints = {}
+    stale = []
+    for csvfile in filelist:
+        if update is not None and csvfile not in update and csvfile in cache:
+            fingerprints[csvfile] = cache[csvfile]['fingerprint']
+            continue
+        stat = os.stat(csvfile)
+        fingerprint = [stat.st_mtime_ns, stat.st_size]
+        fingerprints[csvfile] = fingerprint
+        entry = cache.get(csvfile)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            stale.append(csvfile)
+
+    for csvfile, summary in zip(stale, get_portfolio_summaries(stale, workers, threads, fast, io_limit)):
+        entry = {}
+        entry['fingerprint'] = fingerprints[csvfile]
+        entry['filename'] = summary['filename']
+        entry['date'] = summary['date'].isoformat()
+        entry['cost'] = summary['cost']
+        entry['value'] = summary['value']
+        cache[csvfile] = entry
+
+    for csvfile in list(cache):
+        if csvfile not in fingerprints and not os.path.exists(csvfile):
+            del cache[csvfile]
+
+    summaries = []
+    for csvfile in filelist:
+        entry = cache[csvfile]
+        summary = {}
+        summary['filename'] = entry['filename']
+        summary['date'] = datetime.date.fromisoformat(entry['date'])
+        summary['cost'] = entry['cost']
+        summary['value'] = entry['value']
+        summaries.append(summary)
+    return summaries
+
+def map_portfolio_summary(filelist, summary_folder, workers=1, threads=False, fast=False, cache_file=None, io_limit=None, update=None):
     """
     This function take the list of porfolio files and
     and maps into a CSV file.
@@ -83,12 +280,28 @@ def map_portfolio_summary(filelist, summary_folder):
         filelist - A list of portfolio files.
         summary_folder - Full qualified path of folder where summary files will
         be created.
+        workers - Optional number of workers parsing the files, None for one per CPU
+        threads - Optional flag to use threads instead of processes for the workers
+        fast - Optional flag to look up the totals row from the end of the files
+        cache_file - Optional path of the summary cache, only the files which are
+        new or changed since the last run are parsed
+        io_limit - Optional maximum number of files read concurrently, the files
+        are then read asynchronously and parsed as they arrive
+        update - Optional list of the files to check for changes with the cache,
+        the other files of filelist are taken from the cache when they are in it.
+        The summary files are always written with all the files of filelist.
     """
 
+    if cache_file is None:
+        summaries = get_portfolio_summaries(filelist, workers, threads, fast, io_limit)
+    else:
+        cache = load_summary_cache(cache_file)
+        summaries = get_cached_summaries(filelist, cache, workers, threads, fast, io_limit, update)
+        save_summary_cache(cache, cache_file)
+
     portfolio_updates = {}
 
-    for csvfile in filelist:
-        summary = get_portfolio_summary(csvfile)
+    for summary in summaries:
         filename = summary['filename']
         try:
             file_summary = portfolio_updates[filename]
@@ -102,8 +315,6 @@ def map_portfolio_summary(filelist, summary_folder):
         portfolio_updates[filename] = file_summary
 
     for filename in portfolio_updates:
-        
-        print('Writing file....', filename)
         file_summary = portfolio_updates[filename]
         file_summary_sorted = sorted(file_summary, key=lambda k: k['date'], reverse=False)
 